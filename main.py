@@ -4,20 +4,36 @@ A personal bot for searching, playing, and managing YouTube music.
 """
 
 import os
+import re
+import atexit
+import time
 import asyncio
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from functools import lru_cache
 from datetime import datetime
-from typing import Dict, Optional
+from io import BytesIO
+from itertools import islice
+from typing import Dict, Optional, Tuple, Union
+import httpx
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio
+from PIL import Image
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio, InputFile
 from telegram.ext import (
-    Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler,
+    AIORateLimiter, Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler,
     MessageHandler, filters, ContextTypes
 )
 from telegram.constants import ChatAction
+from telegram.request import HTTPXRequest
 import telegram
 
-from utils.ytdl_wrapper import search_youtube, download_audio_stream, extract_playlist_videos, get_video_info
+from utils.ytdl_wrapper import (
+    search_youtube, download_audio_stream, iter_playlist_videos, aget_video_info, hydrate_playlist,
+    load_video_info_cache, save_video_info_cache,
+    extract_video_id, is_playlist_url, sanitize_filename
+)
 from utils.playlist_manager import PlaylistManager
 from utils.storage import StorageManager
 
@@ -31,25 +47,197 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Thread pools for blocking work, passed explicitly to run_in_pool(). Downloads
+# and metadata lookups each get their own yt-dlp pool so a burst of downloads
+# cannot starve /search or play button taps; file opens and deletes use a
+# small I/O pool so they never queue behind yt-dlp. JSON history and playlist
+# writes go through a single storage thread, which keeps them in order and
+# stops two writers from dumping the same dict at once.
+YTDL_POOL_SIZE = int(os.getenv("YTDL_POOL_SIZE", "16"))
+ytdl_executor = ThreadPoolExecutor(max_workers=YTDL_POOL_SIZE, thread_name_prefix="ytdl")
+metadata_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ytdl-meta")
+io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="io")
+storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+# Drop queued yt-dlp and file work at exit instead of running it first;
+# pending storage writes are still allowed to finish
+for _executor in (ytdl_executor, metadata_executor, io_executor):
+    atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+
+async def run_in_pool(executor: ThreadPoolExecutor, func, *args):
+    """Run a blocking function on the given thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+background_tasks: set = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    """Schedule a coroutine as a background task and log any exception it raises."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task: asyncio.Task) -> None:
+    """Drop a finished background task and log its failure, if any."""
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background task failed: {task.exception()}")
+
+# Plays waiting to be written to history by history_writer()
+history_queue: asyncio.Queue = asyncio.Queue(maxsize=1024)
+
+def queue_history(user_id: int, track_info: Dict) -> None:
+    """Queue a play for the background history writer."""
+    try:
+        history_queue.put_nowait((user_id, track_info))
+    except asyncio.QueueFull:
+        logger.error(f"History queue full, dropping play for user_id={user_id}")
+
+async def history_writer() -> None:
+    """Write queued plays to history, saving each burst of plays once."""
+    while True:
+        plays = [await history_queue.get()]
+        while not history_queue.empty():
+            plays.append(history_queue.get_nowait())
+        try:
+            await run_in_pool(storage_executor, storage_manager.record_plays, plays)
+        except Exception as e:
+            logger.error(f"Error writing history: {e}")
+
+# Storage changes are kept in memory and written to disk at most this often
+STORAGE_FLUSH_SEC = 2
+
+# Video metadata cache saved across restarts, so recently played tracks skip extraction
+VIDEO_INFO_CACHE_FILE = os.path.join("data", "video_info.json")
+
+def flush_storage() -> None:
+    """Write changed history, playlists and video metadata to disk."""
+    storage_manager.flush()
+    playlist_manager.flush()
+    save_video_info_cache(VIDEO_INFO_CACHE_FILE)
+
+async def storage_flush_loop() -> None:
+    """Write changed history and playlists every STORAGE_FLUSH_SEC, coalescing all changes in between."""
+    while True:
+        await asyncio.sleep(STORAGE_FLUSH_SEC)
+        try:
+            # The storage thread also applies every change, so a flush never races one
+            await run_in_pool(storage_executor, flush_storage)
+        except Exception as e:
+            logger.error(f"Error saving storage: {e}")
+
+# Caps simultaneous yt-dlp/ffmpeg downloads across all users; each runs an
+# ffmpeg conversion, so by default one per CPU core
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", str(os.cpu_count() or 4)))
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+# Downloads in progress, keyed by video ID, so concurrent requests share one even across users
+inflight_downloads: Dict[str, asyncio.Task] = {}
+
+async def download_track(url: str) -> Dict:
+    """Download a track's audio, joining the download already running for it if there is one."""
+    key = extract_video_id(url) or url
+    task = inflight_downloads.get(key)
+    if task is None:
+        task = asyncio.create_task(_download_track(url))
+        inflight_downloads[key] = task
+        task.add_done_callback(lambda _: inflight_downloads.pop(key, None))
+    # Shielded so one caller giving up does not cancel the download for the others
+    return await asyncio.shield(task)
+
+async def _download_track(url: str) -> Dict:
+    """Download a track's audio once a download slot is free."""
+    async with download_semaphore:
+        result = await download_audio_stream(url, ytdl_executor, DOWNLOADS_DIR)
+    downloaded_tracks.add(result['id'])
+    return result
+
+# Video IDs of tracks downloaded since startup, so prefetching can skip
+# them without a disk check. Files evicted later are simply downloaded again on play.
+downloaded_tracks: set = set()
+
+# Upcoming playlist tracks whose metadata is fetched as soon as the playlist is queued
+PLAYLIST_INFO_PREFETCH = 5
+
+async def prefetch_video_info(videos: list[dict]) -> None:
+    """Warm the metadata cache for several playlist tracks concurrently."""
+    infos = await hydrate_playlist(videos, metadata_executor)
+    failed = infos.count(None)
+    if failed:
+        logger.error(f"Error prefetching video info for {failed} of {len(videos)} tracks")
+
+# Downloaded audio is kept on disk as a cache, trimmed by cleanup_loop(). ffmpeg
+# postprocessing is disk-bound, so point MUSIC_CACHE_DIR at a fast local disk.
+DOWNLOADS_DIR = os.getenv("MUSIC_CACHE_DIR", "downloads")
+# Filesystems that make a slow download cache (network and userspace mounts)
+SLOW_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "fuse.sshfs", "9p")
+DOWNLOAD_CACHE_MB = int(os.getenv("DOWNLOAD_CACHE_MB", "500"))
+DOWNLOAD_TTL_SEC = int(os.getenv("DOWNLOAD_TTL_SEC", "3600"))
+CLEANUP_INTERVAL_SEC = 900
+
+# Telegram file_id of every uploaded track, keyed by YouTube video ID.
+# Re-sending a file_id skips both the download and the upload. Loaded in
+# post_init and saved to data/file_ids.json whenever it changes.
+audio_file_ids: Dict[str, str] = {}
+
+def save_file_ids() -> None:
+    """Save a snapshot of the file_id cache on the storage thread."""
+    run_in_background(run_in_pool(storage_executor, storage_manager.save_file_ids, dict(audio_file_ids)))
+
+@dataclass(slots=True)
+class Track:
+    """A session queue entry; slots keep long playlist queues compact."""
+    url: str
+    title: str = 'Unknown'
+    duration: int = 0
+    uploader: str = 'Unknown Artist'
+    thumbnail: str = ''
+    id: str = ''
+
+    @classmethod
+    def from_info(cls, info: Dict, url: Optional[str] = None) -> 'Track':
+        """Build a track from a video info or playlist entry dict."""
+        return cls(
+            url=url or info.get('url') or info.get('webpage_url', ''),
+            title=info.get('title') or 'Unknown',
+            duration=int(info.get('duration') or 0),
+            uploader=info.get('uploader') or 'Unknown Artist',
+            thumbnail=info.get('thumbnail') or '',
+            id=info.get('id') or ''
+        )
+
+    def now_playing_text(self) -> str:
+        """Format the now-playing caption: title, author and MM:SS duration."""
+        minutes, seconds = divmod(self.duration, 60)
+        return f"🎶 Now Playing:\n{self.title}\n🧑‍🎤 Author: {self.uploader}\n⏱️ Duration: {minutes:02d}:{seconds:02d}"
+
 class Session:
     """Manages user playback session state."""
     
     def __init__(self):
-        self.queue: list[Dict] = []
+        self.queue: list[Track] = []
         self.current_index: Optional[int] = None
         self.message_id: Optional[int] = None
         self.chat_id: Optional[int] = None
         self.is_paused: bool = False
         self.current_download_task: Optional[asyncio.Task] = None
+        self.current_download_url: Optional[str] = None
         self.downloading_message_id: Optional[int] = None
-
-    def add_track(self, track_info: Dict) -> None:
+        self.prefetch_tasks: Dict[str, asyncio.Task] = {}
+        self.playback_task: Optional[asyncio.Task] = None
+        # Held while a playback loop runs, so a replaced loop finishes unwinding first
+        self.lock = asyncio.Lock()
+        self.last_action_at: float = 0.0
+        self.last_help_at: float = 0.0
+
+    def add_track(self, track: Track) -> None:
         """Add a track to the queue."""
-        self.queue.append(track_info)
+        self.queue.append(track)
         if self.current_index is None:
             self.current_index = 0
 
-    def get_current_track(self) -> Optional[Dict]:
+    def get_current_track(self) -> Optional[Track]:
         """Get the current track info."""
         if self.current_index is None or not self.queue:
             return None
@@ -84,40 +272,78 @@ class Session:
         if self.current_download_task:
             self.current_download_task.cancel()
             self.current_download_task = None
+        self.current_download_url = None
+        for task in self.prefetch_tasks.values():
+            task.cancel()
+        self.prefetch_tasks.clear()
+        # Playback may clear its own session; it returns right after, so only stop other tasks
+        if self.playback_task and self.playback_task is not asyncio.current_task():
+            self.playback_task.cancel()
+        self.playback_task = None
+
+    def start_download(self, url: str) -> asyncio.Task:
+        """Start downloading a track in the background, or return the download already running for it."""
+        if self.current_download_task is None or self.current_download_url != url:
+            if self.current_download_task:
+                self.current_download_task.cancel()
+            self.current_download_task = asyncio.create_task(download_track(url))
+            self.current_download_url = url
+        return self.current_download_task
+
+    def prefetch(self, index: int) -> None:
+        """Download the queued track at index in the background so it is ready when playback reaches it."""
+        if not 0 <= index < len(self.queue):
+            return
+        track = self.queue[index]
+        url = track.url
+        if (track.id or extract_video_id(url)) in audio_file_ids:
+            return
+        task = self.prefetch_tasks.get(url)
+        if task and not task.done():
+            return
+        # download_track joins this download when the track is played, so it is never fetched twice
+        task = run_in_background(download_track(url))
+        self.prefetch_tasks[url] = task
+        task.add_done_callback(lambda t: self.prefetch_tasks.pop(url) if self.prefetch_tasks.get(url) is t else None)
 
 # Initialize utility managers and sessions
 playlist_manager = PlaylistManager()
 storage_manager = StorageManager()
-user_sessions: Dict[int, Session] = {}
+# Sessions in least-recently-used order; the oldest is cleared and dropped past MAX_SESSIONS
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+user_sessions: "OrderedDict[int, Session]" = OrderedDict()
 
 def get_session(user_id: int) -> Session:
     """Get or create a session for the user."""
-    if user_id not in user_sessions:
-        user_sessions[user_id] = Session()
-    return user_sessions[user_id]
+    session = user_sessions.get(user_id)
+    if session is not None:
+        user_sessions.move_to_end(user_id)
+        return session
+    session = user_sessions[user_id] = Session()
+    if len(user_sessions) > MAX_SESSIONS:
+        # Cancels the evicted session's downloads so their tasks do not linger
+        _, evicted = user_sessions.popitem(last=False)
+        evicted.clear()
+    return session
+
+# The playback keyboard only varies with the pause state, so both variants are
+# built once and shared
+PLAYBACK_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⏮️ Prev", callback_data="prev"),
+    InlineKeyboardButton("⏸️ Pause", callback_data="pause"),
+    InlineKeyboardButton("⏭️ Next", callback_data="next"),
+    InlineKeyboardButton("⏹️ Stop", callback_data="stop"),
+]])
+PLAYBACK_KEYBOARD_PAUSED = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⏮️ Prev", callback_data="prev"),
+    InlineKeyboardButton("▶️ Resume", callback_data="resume"),
+    InlineKeyboardButton("⏭️ Next", callback_data="next"),
+    InlineKeyboardButton("⏹️ Stop", callback_data="stop"),
+]])
 
 def build_playback_keyboard(session: Session) -> InlineKeyboardMarkup:
-    """Build the playback control keyboard."""
-    buttons = []
-    row = []
-    
-    # Previous button
-    row.append(InlineKeyboardButton("⏮️ Prev", callback_data="prev"))
-    
-    # Play/Pause button
-    if session.is_paused:
-        row.append(InlineKeyboardButton("▶️ Resume", callback_data="resume"))
-    else:
-        row.append(InlineKeyboardButton("⏸️ Pause", callback_data="pause"))
-    
-    # Next button
-    row.append(InlineKeyboardButton("⏭️ Next", callback_data="next"))
-    
-    # Stop button
-    row.append(InlineKeyboardButton("⏹️ Stop", callback_data="stop"))
-    
-    buttons.append(row)
-    return InlineKeyboardMarkup(buttons)
+    """Get the playback control keyboard for the session's pause state."""
+    return PLAYBACK_KEYBOARD_PAUSED if session.is_paused else PLAYBACK_KEYBOARD
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -140,6 +366,77 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
+async def update_playback_keyboard(query: telegram.CallbackQuery, session: Session) -> None:
+    """Show the keyboard matching the session's pause state on the control message."""
+    try:
+        await query.edit_message_reply_markup(reply_markup=build_playback_keyboard(session))
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
+
+async def playback_prev(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, session: Session) -> None:
+    """Go back to the previous track."""
+    if session.prev_track():
+        start_playback(context, query.from_user.id)
+
+async def playback_pause(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, session: Session) -> None:
+    """Pause playback after the current track."""
+    session.is_paused = True
+    await update_playback_keyboard(query, session)
+
+async def playback_resume(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, session: Session) -> None:
+    """Resume playback from the current track."""
+    session.is_paused = False
+    await update_playback_keyboard(query, session)
+    start_playback(context, query.from_user.id)
+
+async def playback_next(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, session: Session) -> None:
+    """Skip to the next track, or report an exhausted queue."""
+    if session.next_track():
+        start_playback(context, query.from_user.id)
+        return
+    try:
+        await query.edit_message_text(
+            text="❌ Queue is empty. Use /search to add more tracks.",
+            reply_markup=build_playback_keyboard(session)
+        )
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
+
+async def delete_message_quietly(bot: telegram.Bot, chat_id: int, message_id: int) -> None:
+    """Delete a message, ignoring one that is already gone."""
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except telegram.error.BadRequest as e:
+        if "Message to delete not found" not in str(e):
+            logger.error(f"Error deleting message {message_id}: {e}")
+
+async def playback_stop(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, session: Session) -> None:
+    """Stop playback, remove the session's messages and drop the session."""
+    if session.chat_id:
+        # Both deletes are independent, so send them together
+        await asyncio.gather(*(
+            delete_message_quietly(context.bot, session.chat_id, message_id)
+            for message_id in (session.message_id, session.downloading_message_id)
+            if message_id
+        ))
+    session.clear()
+    user_sessions.pop(query.from_user.id, None)
+
+# Presses closer together than this are treated as one (touchscreen double taps)
+BUTTON_DEBOUNCE_SEC = 0.3
+
+PLAYBACK_ACTIONS = {
+    "prev": playback_prev,
+    "pause": playback_pause,
+    "resume": playback_resume,
+    "next": playback_next,
+    "stop": playback_stop,
+}
+# Routes exactly these buttons to playback_callback
+PLAYBACK_PATTERN = re.compile(f"^(?:{'|'.join(PLAYBACK_ACTIONS)})$")
+
 async def playback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle playback control callbacks (prev, pause, resume, next, stop)."""
     query = update.callback_query
@@ -152,61 +449,47 @@ async def playback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         else:
             raise
     
-    user_id = query.from_user.id
-    session = get_session(user_id)
-    action = query.data
-    
-    if action == "prev":
-        if session.prev_track():
-            await start_next(context, user_id)
-    elif action == "pause":
-        session.is_paused = True
-        try:
-            await query.edit_message_reply_markup(reply_markup=build_playback_keyboard(session))
-        except telegram.error.BadRequest as e:
-            if "Message is not modified" not in str(e):
-                raise
-    elif action == "resume":
-        session.is_paused = False
-        try:
-            await query.edit_message_reply_markup(reply_markup=build_playback_keyboard(session))
-        except telegram.error.BadRequest as e:
-            if "Message is not modified" not in str(e):
-                raise
-        await start_next(context, user_id)
-    elif action == "next":
-        if session.next_track():
-            await start_next(context, user_id)
-        else:
-            try:
-                await query.edit_message_text(
-                    text="❌ Queue is empty. Use /search to add more tracks.",
-                    reply_markup=build_playback_keyboard(session)
-                )
-            except telegram.error.BadRequest as e:
-                if "Message is not modified" not in str(e):
-                    raise
-    elif action == "stop":
-        if session.message_id and session.chat_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=session.chat_id,
-                    message_id=session.message_id
-                )
-            except telegram.error.BadRequest as e:
-                if "Message to delete not found" not in str(e):
-                    logger.error(f"Error deleting message: {e}")
-        if session.downloading_message_id and session.chat_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=session.chat_id,
-                    message_id=session.downloading_message_id
-                )
-            except telegram.error.BadRequest as e:
-                if "Message to delete not found" not in str(e):
-                    logger.error(f"Error deleting downloading message: {e}")
-        session.clear()
-        user_sessions.pop(user_id, None)
+    action = PLAYBACK_ACTIONS.get(query.data)
+    if not action:
+        return
+    session = get_session(query.from_user.id)
+    now = time.monotonic()
+    if now - session.last_action_at < BUTTON_DEBOUNCE_SEC:
+        return
+    session.last_action_at = now
+    await action(query, context, session)
+
+# Durations repeat across queues, playlists and history, so each is formatted once
+@lru_cache(maxsize=4096)
+def format_duration(seconds: Optional[int]) -> str:
+    """Format a duration in seconds as '(MM:SS)'."""
+    minutes, seconds = divmod(int(seconds or 0), 60)
+    return f"({minutes:02d}:{seconds:02d})"
+
+# History timestamps never change, so each is formatted once
+@lru_cache(maxsize=1024)
+def format_timestamp(timestamp: Union[int, str]) -> str:
+    """Format a UTC epoch timestamp (or an ISO string from older history) as 'HH:MM YYYY-MM-DD'."""
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).strftime('%H:%M %Y-%m-%d')
+    return time.strftime('%H:%M %Y-%m-%d', time.gmtime(timestamp))
+
+def truncate(text: str, limit: int) -> str:
+    """Shorten text to at most limit characters, ending with '...' when cut."""
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def format_track_button(track: Dict) -> str:
+    """Format a track as button text: 'Title (MM:SS)'."""
+    return f"{truncate(track.get('title', 'Unknown'), 40)} {format_duration(track.get('duration'))}"
+
+def format_search_result(result: Dict) -> str:
+    """Format a search result as button text: 'Title (MM:SS) - Uploader'."""
+    title = truncate(result['title'], 30)
+    uploader = truncate(result.get('uploader') or 'Unknown Artist', 20)
+    # Only show the duration when it is known
+    if not result.get('duration'):
+        return f"{title} - {uploader}"
+    return f"{title} {format_duration(result['duration'])} - {uploader}"
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /search command - search YouTube and return results with inline keyboard."""
@@ -221,38 +504,17 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     try:
         # Search YouTube in executor to avoid blocking
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(None, search_youtube, query, 5)
+        results = await run_in_pool(metadata_executor, search_youtube, query, 5)
         
         if not results:
             await update.message.reply_text("No results found.")
             return
         
         # Build inline keyboard with search results
-        keyboard = []
-        for result in results:
-            # Format duration as MM:SS
-            duration = int(result.get('duration', 0) or 0)
-            minutes, seconds = divmod(duration, 60)
-            duration_str = f"({minutes:02d}:{seconds:02d})"
-            
-            # Format title with uploader
-            title = result['title']
-            uploader = result.get('uploader', 'Unknown Artist')
-            
-            # Truncate title and uploader if needed
-            max_title_len = 30
-            max_uploader_len = 20
-            
-            if len(title) > max_title_len:
-                title = title[:max_title_len-3] + "..."
-            if len(uploader) > max_uploader_len:
-                uploader = uploader[:max_uploader_len-3] + "..."
-            
-            button_text = f"{title} {duration_str} - {uploader}"
-            callback_data = f"play::{result['webpage_url']}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-        
+        keyboard = [
+            [InlineKeyboardButton(format_search_result(result), callback_data=f"play::{result['webpage_url']}")]
+            for result in results
+        ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text("Select a track to play or queue:", reply_markup=reply_markup)
         
@@ -261,160 +523,394 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"❌ Search failed: {str(e)}")
 
 
-def build_now_playing_keyboard(user_id):
-    queue = playlist_manager.list_queue(user_id)
-    buttons = []
-    if queue:
-        buttons.append(InlineKeyboardButton("⏭️ Next", callback_data="queue_next"))
-    buttons.append(InlineKeyboardButton("📜 View Queue", callback_data="queue_view"))
-    buttons.append(InlineKeyboardButton("➕ Add to Playlist", callback_data="add_to_playlist"))
-    return InlineKeyboardMarkup([buttons])
+# The now-playing keyboard only varies with whether the queue is empty, so both
+# variants are built once and shared
+NOW_PLAYING_BUTTONS = [
+    InlineKeyboardButton("📜 View Queue", callback_data="queue_view"),
+    InlineKeyboardButton("➕ Add to Playlist", callback_data="add_to_playlist"),
+]
+NOW_PLAYING_KEYBOARD = InlineKeyboardMarkup([NOW_PLAYING_BUTTONS])
+NOW_PLAYING_KEYBOARD_WITH_NEXT = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("⏭️ Next", callback_data="queue_next"), *NOW_PLAYING_BUTTONS]]
+)
 
+def build_now_playing_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """Get the now-playing keyboard, with a Next button if the user's queue has tracks."""
+    if playlist_manager.queue_len(user_id):
+        return NOW_PLAYING_KEYBOARD_WITH_NEXT
+    return NOW_PLAYING_KEYBOARD
 
-async def predownload_next(user_id):
-    queue = playlist_manager.list_queue(user_id)
-    if queue:
-        next_track = queue[0]
-        url = next_track.get('url')
-        from utils.ytdl_wrapper import download_audio_stream
-        loop = asyncio.get_event_loop()
-        # Only download if not already downloaded
-        await loop.run_in_executor(None, download_audio_stream, url, user_id)
+
+UPLOAD_BUFFER_SIZE = 64 * 1024
+
+async def send_audio_file(context: ContextTypes.DEFAULT_TYPE, chat_id: int, filepath: str,
+                          video_id: str = '', thumbnail_path: Optional[str] = None,
+                          filename: Optional[str] = None, **kwargs) -> telegram.Message:
+    """
+    Upload an audio file (and optional thumbnail) from disk without reading it on the event loop.
+    
+    The file handles are passed to the HTTP transport as-is, so they are streamed
+    in chunks instead of being loaded into memory before the upload; the upload
+    size comes from the file's metadata rather than a read pass.
+    If video_id is given, the resulting Telegram file_id is remembered for replays.
+    filename is the name users see for the file (the file's own name if None).
+    Extra keyword arguments are forwarded to send_audio.
+    """
+    # A 64 KiB buffer matches httpx's upload chunk size, so each chunk is one read() syscall
+    audio_file = await run_in_pool(io_executor, open, filepath, 'rb', UPLOAD_BUFFER_SIZE)
+    thumb_file = None
+    try:
+        if thumbnail_path:
+            thumb_file = await run_in_pool(io_executor, open, thumbnail_path, 'rb')
+            kwargs['thumbnail'] = InputFile(
+                thumb_file, filename=os.path.basename(thumbnail_path), attach=True, read_file_handle=False
+            )
+        message = await context.bot.send_audio(
+            chat_id=chat_id,
+            audio=InputFile(audio_file, filename=filename or os.path.basename(filepath), read_file_handle=False),
+            **kwargs
+        )
+    finally:
+        audio_file.close()
+        if thumb_file:
+            thumb_file.close()
+    if video_id and message.audio:
+        audio_file_ids[video_id] = message.audio.file_id
+        save_file_ids()
+    return message
+
+
+async def send_cached_audio(context: ContextTypes.DEFAULT_TYPE, chat_id: int, video_id: str,
+                            **kwargs) -> Optional[telegram.Message]:
+    """
+    Re-send a previously uploaded track by its Telegram file_id.
+    
+    Returns the sent message, or None if the track has not been uploaded before
+    (or Telegram no longer accepts the cached file_id).
+    """
+    file_id = audio_file_ids.get(video_id)
+    if not file_id:
+        return None
+    try:
+        return await context.bot.send_audio(chat_id=chat_id, audio=file_id, **kwargs)
+    except telegram.error.BadRequest as e:
+        logger.error(f"Cached file_id rejected for {video_id}: {e}")
+        audio_file_ids.pop(video_id, None)
+        save_file_ids()
+        return None
 
 
+async def keep_chat_action(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                           action: str = ChatAction.UPLOAD_VOICE) -> None:
+    """Send a chat action and repeat it until cancelled (Telegram clears it after ~5 seconds)."""
+    while True:
+        try:
+            await context.bot.send_chat_action(chat_id=chat_id, action=action)
+        except Exception as e:
+            logger.error(f"Error sending chat action: {e}")
+        await asyncio.sleep(4)
+
+
+# Resized thumbnails are kept by video ID so re-uploads skip the fetch and resize;
+# the oldest file is deleted once the cache is full
+THUMBNAIL_DIR = os.path.join(DOWNLOADS_DIR, "thumbnails")
+THUMBNAIL_CACHE_SIZE = 256
+thumbnail_paths: Dict[str, str] = {}
+# Shared async client for thumbnail downloads: one connection pool, closed in post_shutdown
+thumbnail_client = httpx.AsyncClient(http2=True, timeout=10, limits=httpx.Limits(max_connections=32))
+
+def save_thumbnail(data: bytes, video_id: str) -> str:
+    """Resize a downloaded thumbnail for an audio upload and save it. Returns its path."""
+    img = Image.open(BytesIO(data))
+    # Let the JPEG decoder downscale while decoding, then resize to 320x180
+    img.draft('RGB', (320, 180))
+    img.thumbnail((320, 180))
+    thumbnail_path = os.path.join(THUMBNAIL_DIR, f"{video_id}.jpg")
+    img.save(thumbnail_path, "JPEG")
+    return thumbnail_path
+
+def load_thumbnail_index() -> None:
+    """Index thumbnails saved by earlier runs, oldest first, deleting those beyond THUMBNAIL_CACHE_SIZE."""
+    with os.scandir(THUMBNAIL_DIR) as entries:
+        thumbnails = sorted(
+            (entry.stat().st_mtime, entry.name[:-4], entry.path)
+            for entry in entries
+            if entry.name.endswith('.jpg') and entry.is_file(follow_symlinks=False)
+        )
+    excess = max(len(thumbnails) - THUMBNAIL_CACHE_SIZE, 0)
+    for _, _, path in thumbnails[:excess]:
+        remove_file(path)
+    thumbnail_paths.update((video_id, path) for _, video_id, path in thumbnails[excess:])
+
+async def prepare_thumbnail(thumbnail_url: str, video_id: str) -> Optional[str]:
+    """Get a track's resized thumbnail, downloading it if it is not cached. Returns its path, or None."""
+    cached = thumbnail_paths.get(video_id)
+    if cached:
+        return cached
+    try:
+        response = await thumbnail_client.get(thumbnail_url)
+        if response.status_code != 200:
+            return None
+        thumbnail_path = await run_in_pool(io_executor, save_thumbnail, response.content, video_id)
+    except Exception as e:
+        logger.error(f"Error downloading thumbnail: {e}")
+        return None
+    if len(thumbnail_paths) >= THUMBNAIL_CACHE_SIZE:
+        run_in_background(run_in_pool(io_executor, remove_file, thumbnail_paths.pop(next(iter(thumbnail_paths)))))
+    thumbnail_paths[video_id] = thumbnail_path
+    return thumbnail_path
+
+
+async def play_url(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, url: str,
+                   track: Optional[Dict] = None, download=None, thumbnail: bool = False,
+                   **kwargs) -> Dict:
+    """
+    Send a single track to a chat and record it in the user's history.
+    
+    Re-sends the track by file_id if it was uploaded before, otherwise downloads
+    and uploads it, with a resized thumbnail if thumbnail is True. download is an
+    optional callable returning the download awaitable, used instead of
+    download_track (e.g. to reuse a session's download). Metadata missing from
+    track is filled in from the download. Extra keyword arguments are forwarded
+    to send_audio. Returns the track metadata that was used.
+    """
+    track_info = track if track is not None else {}
+    video_id = track_info.get('id') or extract_video_id(url)
+    # Show "uploading" without waiting for the API call before starting the download
+    action_task = asyncio.create_task(keep_chat_action(context, chat_id))
+    try:
+        sent = await send_cached_audio(
+            context, chat_id, video_id,
+            title=track_info.get('title', 'Unknown'),
+            duration=track_info.get('duration', 0),
+            performer=track_info.get('uploader', 'Unknown Artist'),
+            **kwargs
+        )
+        if sent is None:
+            # The download returns the metadata it extracted, so no separate info lookup
+            result = await (download() if download else download_track(url))
+            for key, value in result.items():
+                if key != 'filepath' and not track_info.get(key):
+                    track_info[key] = value
+            
+            thumbnail_path = None
+            if thumbnail and track_info.get('thumbnail'):
+                thumbnail_path = await prepare_thumbnail(track_info['thumbnail'], video_id)
+            # Falls back to audio without thumbnail if none was prepared
+            await send_audio_file(
+                context, chat_id, result['filepath'], video_id=video_id,
+                thumbnail_path=thumbnail_path,
+                # Cached files are named by video ID; users get the title instead
+                filename=f"{sanitize_filename(track_info.get('title', 'Unknown'))}.m4a",
+                title=track_info.get('title', 'Unknown'),
+                duration=track_info.get('duration', 0),
+                performer=track_info.get('uploader', 'Unknown Artist'),
+                **kwargs
+            )
+    finally:
+        action_task.cancel()
+    queue_history(user_id, {
+        'title': track_info.get('title', 'Unknown'),
+        'url': url,
+        'duration': track_info.get('duration', 0),
+        'uploader': track_info.get('uploader', 'Unknown Artist')
+    })
+    return track_info
+
+
+async def play_queued_track(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, track: Dict) -> None:
+    """Play a track from a queue or playlist, then pre-download the next queued tracks."""
+    try:
+        await play_url(
+            context, chat_id, user_id, track.get('url'), track,
+            reply_markup=build_now_playing_keyboard(user_id)
+        )
+    except Exception as e:
+        logger.error(f"Error playing queued track: {e}")
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Could not play {track.get('title', 'Unknown')}: {e}")
+        return
+    await predownload_upcoming(user_id)
+
+
+# Queued tracks downloaded ahead of time after each play
+PREDOWNLOAD_COUNT = 2
+
+async def predownload_upcoming(user_id: int, count: int = PREDOWNLOAD_COUNT) -> None:
+    """Download the next few queued tracks concurrently, skipping those already available."""
+    downloads = []
+    for track in islice(playlist_manager.list_queue(user_id), count):
+        url = track.get('url')
+        video_id = track.get('id') or extract_video_id(url)
+        # Only download if Telegram does not have it and it was not downloaded already
+        if video_id in audio_file_ids or video_id in downloaded_tracks:
+            continue
+        # download_semaphore bounds these, and a track already downloading is joined
+        downloads.append(download_track(url))
+    for result in await asyncio.gather(*downloads, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"Error pre-downloading track: {result}")
+
+
+def start_playback(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+    """Play the session's current track in the background, replacing any playback already running."""
+    session = get_session(user_id)
+    if session.playback_task and not session.playback_task.done():
+        session.playback_task.cancel()
+    session.playback_task = run_in_background(start_next(context, user_id))
+
 async def start_next(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
-    """Start playing the next track in the queue."""
+    """Play the current track, then keep auto-advancing through the queue."""
+    async with get_session(user_id).lock:
+        # AIORateLimiter paces the API calls, so tracks follow each other without a pause
+        while await play_current(context, user_id):
+            pass
+
+async def send_downloading_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, track: Track) -> Optional[int]:
+    """Tell the user a track is being downloaded. Returns the message ID, or None if it could not be sent."""
+    try:
+        downloading_message = await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"⏬ Downloading {track.title}... please wait"
+        )
+        return downloading_message.message_id
+    except Exception as e:
+        logger.error(f"Error sending downloading message: {e}")
+        return None
+
+async def discard_downloading_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                                      downloading: asyncio.Task) -> None:
+    """Wait for a "Downloading..." message that is no longer needed to be sent, then delete it."""
+    message_id = await downloading
+    if message_id:
+        await delete_message_quietly(context.bot, chat_id, message_id)
+
+async def send_now_playing(context: ContextTypes.DEFAULT_TYPE, session: Session, track: Track,
+                           text: str) -> telegram.Message:
+    """Send a new "Now Playing" message, as a photo if the track has a thumbnail."""
+    if track.thumbnail:
+        try:
+            return await context.bot.send_photo(
+                chat_id=session.chat_id,
+                photo=track.thumbnail,
+                caption=text,
+                reply_markup=build_playback_keyboard(session)
+            )
+        except Exception as e:
+            # Fall back to a text-only message
+            logger.error(f"Error sending thumbnail: {e}")
+    return await context.bot.send_message(
+        chat_id=session.chat_id,
+        text=text,
+        reply_markup=build_playback_keyboard(session)
+    )
+
+async def update_now_playing(context: ContextTypes.DEFAULT_TYPE, session: Session, track: Track,
+                             text: str) -> None:
+    """
+    Show a new track on the session's "Now Playing" message.
+    
+    A track with a thumbnail gets a new photo message that replaces the old one;
+    otherwise (or if the photo fails) the old message's text is edited in place.
+    """
+    if track.thumbnail:
+        try:
+            message = await context.bot.send_photo(
+                chat_id=session.chat_id,
+                photo=track.thumbnail,
+                caption=text,
+                reply_markup=build_playback_keyboard(session)
+            )
+        except Exception as e:
+            logger.error(f"Error sending thumbnail: {e}")
+        else:
+            old_message_id, session.message_id = session.message_id, message.message_id
+            await delete_message_quietly(context.bot, session.chat_id, old_message_id)
+            return
+    await context.bot.edit_message_text(
+        chat_id=session.chat_id,
+        message_id=session.message_id,
+        text=text,
+        reply_markup=build_playback_keyboard(session)
+    )
+
+async def play_current(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    """Play the session's current track. Returns True if it was sent and the session advanced to the next one."""
     session = get_session(user_id)
     logger.info(f"[start_next] user_id={user_id} current_index={session.current_index} queue_len={len(session.queue)} is_paused={session.is_paused}")
     if not session.queue or session.current_index is None:
         logger.info(f"[start_next] No queue or current_index is None for user_id={user_id}")
-        return
+        return False
 
     track = session.get_current_track()
     if not track:
         logger.info(f"[start_next] No current track for user_id={user_id}")
-        return
+        return False
 
-    try:
-        # Format duration as MM:SS
-        duration = track.get('duration', 0)
-        minutes, seconds = divmod(duration, 60)
-        duration_str = f"{minutes:02d}:{seconds:02d}"
+    # Start the download now so it overlaps the status messages below;
+    # play_url picks up the same task. Tracks Telegram already has need none.
+    if not session.is_paused and (track.id or extract_video_id(track.url)) not in audio_file_ids:
+        session.start_download(track.url)
+    # Fetch the following track while this one is sent and listened to
+    if not session.is_paused:
+        session.prefetch(session.current_index + 1)
 
+    try:
         # Update the "Now Playing" message
-        message_text = (
-            f"🎶 Now Playing:\n"
-            f"{track['title']}\n"
-            f"🧑‍🎤 Author: {track.get('uploader', 'Unknown Artist')}\n"
-            f"⏱️ Duration: {duration_str}"
-        )
+        message_text = track.now_playing_text()
 
-        # Send "Downloading..." message
-        if session.chat_id:
-            try:
-                downloading_message = await context.bot.send_message(
-                    chat_id=session.chat_id,
-                    text=f"⏬ Downloading {track['title']}... please wait"
-                )
-                session.downloading_message_id = downloading_message.message_id
-            except Exception as e:
-                logger.error(f"Error sending downloading message: {e}")
-
-        if session.message_id and session.chat_id:
-            try:
-                # If we have a thumbnail, send it first
-                if track.get('thumbnail'):
-                    try:
-                        await context.bot.send_photo(
-                            chat_id=session.chat_id,
-                            photo=track['thumbnail'],
-                            caption=message_text,
-                            reply_markup=build_playback_keyboard(session)
-                        )
-                        # Delete the old message if it exists
-                        try:
-                            await context.bot.delete_message(
-                                chat_id=session.chat_id,
-                                message_id=session.message_id
-                            )
-                        except telegram.error.BadRequest as e:
-                            if "Message to delete not found" not in str(e):
-                                logger.error(f"Error deleting old message: {e}")
-                    except Exception as e:
-                        logger.error(f"Error sending thumbnail: {e}")
-                        # Fallback to text-only message if thumbnail fails
-                        await context.bot.edit_message_text(
-                            chat_id=session.chat_id,
-                            message_id=session.message_id,
-                            text=message_text,
-                            reply_markup=build_playback_keyboard(session)
-                        )
-                else:
-                    # No thumbnail, just update text
-                    await context.bot.edit_message_text(
-                        chat_id=session.chat_id,
-                        message_id=session.message_id,
-                        text=message_text,
-                        reply_markup=build_playback_keyboard(session)
-                    )
-            except telegram.error.BadRequest as e:
-                if "Message is not modified" not in str(e):
+        # Send "Downloading..." while the "Now Playing" message is updated, not one after the other
+        chat_id = session.chat_id
+        downloading = run_in_background(send_downloading_message(context, chat_id, track)) if chat_id else None
+        try:
+            if session.message_id and session.chat_id:
+                try:
+                    await update_now_playing(context, session, track, message_text)
+                except telegram.error.BadRequest as e:
+                    if "Message is not modified" not in str(e):
+                        logger.error(f"Error updating message: {e}")
+                        # Session might have expired
+                        session.clear()
+                        user_sessions.pop(user_id, None)
+                        return False
+                except Exception as e:
                     logger.error(f"Error updating message: {e}")
                     # Session might have expired
                     session.clear()
                     user_sessions.pop(user_id, None)
-                    return
-            except Exception as e:
-                logger.error(f"Error updating message: {e}")
-                # Session might have expired
-                session.clear()
-                user_sessions.pop(user_id, None)
-                return
-        else:
-            # Create new "Now Playing" message if it doesn't exist
-            if track.get('thumbnail'):
-                try:
-                    message = await context.bot.send_photo(
-                        chat_id=session.chat_id,
-                        photo=track['thumbnail'],
-                        caption=message_text,
-                        reply_markup=build_playback_keyboard(session)
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending thumbnail: {e}")
-                    # Fallback to text-only message if thumbnail fails
-                    message = await context.bot.send_message(
-                        chat_id=session.chat_id,
-                        text=message_text,
-                        reply_markup=build_playback_keyboard(session)
-                    )
+                    return False
             else:
-                message = await context.bot.send_message(
-                    chat_id=session.chat_id,
-                    text=message_text,
-                    reply_markup=build_playback_keyboard(session)
-                )
-            session.message_id = message.message_id
-            session.chat_id = message.chat_id
+                # Create new "Now Playing" message if it doesn't exist
+                message = await send_now_playing(context, session, track, message_text)
+                session.message_id = message.message_id
+                session.chat_id = message.chat_id
+
+            if downloading:
+                # Shielded so a cancelled playback leaves the send running for the cleanup below
+                session.downloading_message_id = await asyncio.shield(downloading)
+                downloading = None
+        finally:
+            # Playback is not going ahead (error, cleared session or cancellation):
+            # remove the "Downloading..." message once it has been sent
+            if downloading:
+                run_in_background(discard_downloading_message(context, chat_id, downloading))
 
         # Download and send the audio file
         if not session.is_paused:
             try:
-                # Send immediate "uploading" status
-                await context.bot.send_chat_action(
-                    chat_id=session.chat_id,
-                    action=ChatAction.UPLOAD_VOICE
-                )
-                
-                # Download audio
-                result = await download_audio_stream(track['url'], user_id)
-                filepath = result['filepath']
-                
-                # Update track info with metadata if not already present
-                if 'uploader' not in track:
-                    track['uploader'] = result['uploader']
-                if 'thumbnail' not in track:
-                    track['thumbnail'] = result['thumbnail']
+                try:
+                    # Reuse a download already started for this track (e.g. the playlist prefetch)
+                    info = await play_url(
+                        context, session.chat_id, user_id, track.url, asdict(track),
+                        download=lambda: session.start_download(track.url),
+                        thumbnail=True,
+                        caption=message_text
+                    )
+                    # Keep what the download learned for replays of this entry
+                    track.id = info['id']
+                    track.thumbnail = info['thumbnail']
+                finally:
+                    session.current_download_task = None
+                    session.current_download_url = None
                 
                 # Delete the "Downloading..." message if it exists
                 if session.downloading_message_id and session.chat_id:
@@ -428,81 +924,12 @@ async def start_next(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
                             logger.error(f"Error deleting downloading message: {e}")
                     session.downloading_message_id = None
                 
-                # Download thumbnail if available
-                thumbnail_path = None
-                if track.get('thumbnail'):
-                    try:
-                        import requests
-                        from io import BytesIO
-                        from PIL import Image
-                        
-                        # Create thumbnail directory if it doesn't exist
-                        thumb_dir = os.path.join("downloads", str(user_id), "thumbnails")
-                        os.makedirs(thumb_dir, exist_ok=True)
-                        
-                        # Download and resize thumbnail
-                        response = requests.get(track['thumbnail'])
-                        if response.status_code == 200:
-                            img = Image.open(BytesIO(response.content))
-                            # Resize to a reasonable size (320x180)
-                            img.thumbnail((320, 180))
-                            thumbnail_path = os.path.join(thumb_dir, f"{track['id']}.jpg")
-                            img.save(thumbnail_path, "JPEG")
-                    except Exception as e:
-                        logger.error(f"Error downloading thumbnail: {e}")
-                        thumbnail_path = None
-                
-                # Send audio with thumbnail and caption
-                try:
-                    if thumbnail_path and os.path.exists(thumbnail_path):
-                        with open(thumbnail_path, 'rb') as thumb_file, open(filepath, 'rb') as audio_file:
-                            await context.bot.send_audio(
-                                chat_id=session.chat_id,
-                                audio=audio_file,
-                                title=track['title'],
-                                duration=track.get('duration', 0),
-                                performer=track.get('uploader', 'Unknown Artist'),
-                                caption=message_text,
-                                thumb=thumb_file
-                            )
-                    else:
-                        # Fallback to audio without thumbnail
-                        with open(filepath, 'rb') as audio_file:
-                            await context.bot.send_audio(
-                                chat_id=session.chat_id,
-                                audio=audio_file,
-                                title=track['title'],
-                                duration=track.get('duration', 0),
-                                performer=track.get('uploader', 'Unknown Artist'),
-                                caption=message_text
-                            )
-                finally:
-                    # Clean up thumbnail file
-                    if thumbnail_path and os.path.exists(thumbnail_path):
-                        try:
-                            os.remove(thumbnail_path)
-                        except Exception as e:
-                            logger.error(f"Error removing thumbnail file: {e}")
-                
-                # Record in history
-                storage_manager.record_play(user_id, {
-                    'title': track['title'],
-                    'url': track['url'],
-                    'duration': track.get('duration', 0),
-                    'uploader': track.get('uploader', 'Unknown Artist')
-                })
-                
-                # Clean up the downloaded file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                
                 # Check if there's a next track
                 logger.info(f"[start_next] Finished sending audio for index={session.current_index} queue_len={len(session.queue)}")
                 if session.current_index + 1 < len(session.queue):
                     logger.info(f"[start_next] Auto-advancing to next track for user_id={user_id}")
                     session.current_index += 1
-                    await asyncio.sleep(1)
-                    await start_next(context, user_id)
+                    return True
                 else:
                     logger.info(f"[start_next] Queue finished for user_id={user_id}")
                     if session.message_id and session.chat_id:
@@ -526,7 +953,7 @@ async def start_next(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
                             logger.error(f"Error sending queue finished message: {e}")
             except Exception as e:
                 logger.error(f"Error downloading/sending audio: {e}")
-                error_text = f"❌ Could not play {track['title']}: {str(e)}"
+                error_text = f"❌ Could not play {track.title}: {str(e)}"
                 if session.message_id and session.chat_id:
                     try:
                         await context.bot.edit_message_text(
@@ -556,6 +983,7 @@ async def start_next(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
                     logger.error(f"Error updating error message: {e}")
             except Exception as e:
                 logger.error(f"Error updating error message: {e}")
+    return False
 
 async def play_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle inline button clicks to play or queue a selected track."""
@@ -570,57 +998,86 @@ async def play_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not session.chat_id:
         session.chat_id = query.message.chat_id
 
-    # Delete the search results inline keyboard message
-    try:
-        await context.bot.delete_message(chat_id=query.message.chat_id, message_id=query.message.message_id)
-    except Exception:
-        pass
-    # Delete the user's /search message if available
-    try:
-        if query.message.reply_to_message:
-            await context.bot.delete_message(chat_id=query.message.chat_id, message_id=query.message.reply_to_message.message_id)
-    except Exception:
-        pass
+    # The query is already answered; do the slow work off the handler
+    run_in_background(play_selected_track(context, query, user_id, url))
+
+async def play_selected_track(context: ContextTypes.DEFAULT_TYPE, query: telegram.CallbackQuery,
+                              user_id: int, url: str) -> None:
+    """Start or enqueue a track picked from the search results."""
+    session = get_session(user_id)
 
-    # Get video info to store metadata
+    # Delete the search results message and the user's /search message together
+    deletes = [delete_message_quietly(context.bot, query.message.chat_id, query.message.message_id)]
+    if query.message.reply_to_message:
+        deletes.append(delete_message_quietly(context.bot, query.message.chat_id, query.message.reply_to_message.message_id))
+    await asyncio.gather(*deletes, return_exceptions=True)
+
+    # Get video info to store metadata (skip the executor on a cache hit)
     try:
-        info = await asyncio.get_event_loop().run_in_executor(None, get_video_info, url)
-        track_info = {
-            "title": info.get('title', 'Unknown'),
-            "url": url,
-            "duration": info.get('duration', 0),
-            "uploader": info.get('uploader', 'Unknown Artist'),
-            "thumbnail": info.get('thumbnail', '')
-        }
+        info = await aget_video_info(url, metadata_executor)
+        track = Track.from_info(info, url)
     except Exception as e:
         logger.error(f"Error getting video info: {e}")
-        track_info = {
-            "title": "Unknown",
-            "url": url,
-            "duration": 0,
-            "uploader": "Unknown Artist",
-            "thumbnail": ""
-        }
+        track = Track(url=url)
 
     # If queue is empty, add and start playback
     if not session.queue:
-        session.queue = [track_info]
+        session.queue = [track]
         session.current_index = 0
         session.is_paused = False
         logger.info(f"[play_callback] Starting new queue for user_id={user_id}")
-        await start_next(context, user_id)
+        start_playback(context, user_id)
     else:
         # Otherwise, append to queue
-        session.queue.append(track_info)
+        session.queue.append(track)
         logger.info(f"[play_callback] Appended to queue for user_id={user_id} queue_len={len(session.queue)}")
         # Optionally, send a quick confirmation and delete it immediately
         try:
-            added_msg = await context.bot.send_message(chat_id=query.message.chat_id, text=f"✅ Added to queue: {track_info['title']}")
+            added_msg = await context.bot.send_message(chat_id=query.message.chat_id, text=f"✅ Added to queue: {track.title}")
             await asyncio.sleep(1)
             await context.bot.delete_message(chat_id=added_msg.chat_id, message_id=added_msg.message_id)
         except Exception:
             pass
 
+# Playlist entries read before playback starts; the rest is read PLAYLIST_PAGE_SIZE at a time
+PLAYLIST_FIRST_PAGE = PLAYLIST_INFO_PREFETCH + 1
+PLAYLIST_PAGE_SIZE = 100
+
+def take(iterator, count: int) -> list:
+    """Read up to count items from an iterator."""
+    return list(islice(iterator, count))
+
+async def enqueue_playlist_rest(context: ContextTypes.DEFAULT_TYPE, user_id: int, session: Session,
+                                queue: list, videos) -> None:
+    """Append the rest of a playlist to the queue it started, then briefly announce its length."""
+    try:
+        while True:
+            page = await run_in_pool(metadata_executor, take, videos, PLAYLIST_PAGE_SIZE)
+            # Stop if the session was dropped, stopped or given another queue meanwhile
+            if user_sessions.get(user_id) is not session or session.queue is not queue or not queue:
+                return
+            if not page:
+                break
+            queue.extend(Track.from_info(video) for video in page)
+    except Exception as e:
+        logger.error(f"Error extracting rest of playlist: {e}")
+        try:
+            await context.bot.send_message(chat_id=session.chat_id, text=f"❌ Error extracting playlist: {e}")
+        except Exception:
+            pass
+        return
+    finally:
+        # Close the page generator (and its YoutubeDL) off the event loop
+        await run_in_pool(metadata_executor, videos.close)
+    logger.info(f"[play_command] Enqueued playlist for user_id={user_id} queue_len={len(queue)}")
+    # Optionally, send a quick playlist enqueued notification and delete it
+    try:
+        enq_msg = await context.bot.send_message(chat_id=session.chat_id, text=f"🚀 Playlist enqueued: {len(queue)} tracks.")
+        await asyncio.sleep(1)
+        await context.bot.delete_message(chat_id=enq_msg.chat_id, message_id=enq_msg.message_id)
+    except Exception:
+        pass
+
 async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /play: play single video or enqueue entire playlist."""
     if not context.args:
@@ -633,34 +1090,47 @@ async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     session.chat_id = update.message.chat_id
 
     # Detect playlist URL
-    if "playlist?list=" in url or "&list=" in url:
+    if is_playlist_url(url):
+        videos = None
         try:
-            videos = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: extract_playlist_videos(url)
-            )
-            session.queue = videos
+            # Only the first page is read before playback starts; enqueue_playlist_rest() adds the rest
+            videos = iter_playlist_videos(url)
+            first_page = await run_in_pool(metadata_executor, take, videos, PLAYLIST_FIRST_PAGE)
+            if not first_page:
+                await update.message.reply_text("❌ The playlist is empty.")
+                return
+            session.queue = [Track.from_info(video) for video in first_page]
             session.current_index = 0
             session.is_paused = False
-            logger.info(f"[play_command] Enqueued playlist for user_id={user_id} queue_len={len(videos)}")
+            logger.info(f"[play_command] Enqueued playlist first page for user_id={user_id} queue_len={len(first_page)}")
+            session.start_download(first_page[0]['url'])
+            # Look up the tracks after it concurrently so their downloads skip extraction
+            run_in_background(prefetch_video_info(first_page[1:PLAYLIST_INFO_PREFETCH + 1]))
             # Delete the user's /play command message
             try:
                 await context.bot.delete_message(chat_id=update.message.chat_id, message_id=update.message.message_id)
             except Exception:
                 pass
-            # Optionally, send a quick playlist enqueued notification and delete it
-            try:
-                enq_msg = await context.bot.send_message(chat_id=update.message.chat_id, text=f"🚀 Playlist enqueued: {len(videos)} tracks.")
-                await asyncio.sleep(1)
-                await context.bot.delete_message(chat_id=enq_msg.chat_id, message_id=enq_msg.message_id)
-            except Exception:
-                pass
-            await start_next(context, user_id)
+            start_playback(context, user_id)
+            run_in_background(enqueue_playlist_rest(context, user_id, session, session.queue, videos))
+            # enqueue_playlist_rest() now owns the generator and closes it
+            videos = None
         except Exception as e:
             await update.message.reply_text(f"❌ Error extracting playlist: {e}")
+        finally:
+            # Release the extractor's YoutubeDL when the playlist never reached the background task
+            if videos is not None:
+                await run_in_pool(metadata_executor, videos.close)
         return
 
     # Otherwise, play single video
-    session.queue = [{"title": "Unknown", "url": url, "duration": None}]
+    track = Track(url=url)
+    try:
+        info = await aget_video_info(url, metadata_executor)
+        track = Track.from_info(info, url)
+    except Exception as e:
+        logger.error(f"Error getting video info: {e}")
+    session.queue = [track]
     session.current_index = 0
     session.is_paused = False
     logger.info(f"[play_command] Playing single video for user_id={user_id}")
@@ -669,36 +1139,25 @@ async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await context.bot.delete_message(chat_id=update.message.chat_id, message_id=update.message.message_id)
     except Exception:
         pass
-    await start_next(context, user_id)
+    start_playback(context, user_id)
 
 async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /next or /queue: play the next track in the user's queue."""
     user_id = update.message.from_user.id
-    next_track = playlist_manager.dequeue(user_id)
+    next_track = await run_in_pool(storage_executor, playlist_manager.dequeue, user_id)
 
     if not next_track:
         await update.message.reply_text("Your queue is empty. Use /search to add something.")
         return
 
-    url = next_track["url"]
-    title = next_track.get("title", "Unknown Title")
-    await update.message.chat.send_action(action=ChatAction.UPLOAD_VOICE)
-
-    try:
-        audio_path = await download_audio_stream(url, user_id)
-        with open(audio_path, "rb") as audio_file:
-            await update.message.reply_audio(audio=audio_file, title=title)
-
-        storage_manager.record_play(user_id, next_track)
-        os.remove(audio_path)
-
-    except Exception as e:
-        await update.message.reply_text(f"❌ Error playing next track: {e}")
+    # Same path as the queue's Next button: now-playing keyboard, then pre-download what follows
+    run_in_background(play_queued_track(context, update.message.chat_id, user_id, next_track))
 
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /history command - show recent play history."""
     user_id = update.effective_user.id
-    session = get_session(user_id)
+    # Look the session up without creating one for users who are not playing anything
+    session = user_sessions.get(user_id)
     history = storage_manager.get_history(user_id)
     
     if not history:
@@ -706,196 +1165,243 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     # Build history message
-    message = "📜 Your Recent Plays:\n\n"
-    for entry in history:
-        # Format timestamp
-        timestamp = datetime.fromisoformat(entry['timestamp'])
-        time_str = timestamp.strftime("%H:%M %Y-%m-%d")
-        
-        # Format duration
-        duration = int(entry.get('duration', 0) or 0)
-        minutes, seconds = divmod(duration, 60)
-        duration_str = f"({minutes:02d}:{seconds:02d})"
-        
-        message += f"▶️ [{time_str}] {entry['title']} {duration_str}\n"
+    message = "📜 Your Recent Plays:\n\n" + "".join(
+        f"▶️ [{format_timestamp(entry['timestamp'])}] "
+        f"{entry['title']} {format_duration(entry.get('duration'))}\n"
+        for entry in history
+    )
     
     # Add current session info if active
-    if session.queue and session.current_index is not None:
+    if session and session.queue and session.current_index is not None:
         current = session.get_current_track()
         if current:
-            message += f"\n🎵 Now Playing: {current['title']}"
+            message += f"\n🎵 Now Playing: {current.title}"
     
     await update.message.reply_text(message)
 
 
+HELP_TEXT = (
+    "❓ Available commands:\n"
+    "• /search <keywords> - Find music\n"
+    "• /play <URL> - Play video/playlist\n"
+    "• /queue - View queue\n"
+    "• /history - View history"
+)
+HELP_TEXT_ACTIVE = HELP_TEXT + "\n\n💡 Tap ▶️ to resume or ⏭️ to play next track"
+# Further unknown messages within this window get no new help message
+HELP_THROTTLE_SEC = 5
+
 async def fallback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle unrecognized messages."""
-    user_id = update.effective_user.id
-    session = get_session(user_id)
+    # Look the session up without creating one for users who are not playing anything
+    session = user_sessions.get(update.effective_user.id)
     
     # Check if user has an active session
-    if session.message_id and session.chat_id:
+    if session and session.message_id and session.chat_id:
+        now = time.monotonic()
+        if now - session.last_help_at < HELP_THROTTLE_SEC:
+            return
+        session.last_help_at = now
         try:
             # Try to update the existing message
             await context.bot.edit_message_text(
                 chat_id=session.chat_id,
                 message_id=session.message_id,
-                text="❓ Available commands:\n"
-                     "• /search <keywords> - Find music\n"
-                     "• /play <URL> - Play video/playlist\n"
-                     "• /queue - View queue\n"
-                     "• /history - View history\n\n"
-                     "💡 Tap ▶️ to resume or ⏭️ to play next track",
+                text=HELP_TEXT_ACTIVE,
                 reply_markup=build_playback_keyboard(session)
             )
         except Exception as e:
             logger.error(f"Error updating message: {e}")
             # If message update fails, send new message
-            await update.message.reply_text(
-                "❓ Available commands:\n"
-                "• /search <keywords> - Find music\n"
-                "• /play <URL> - Play video/playlist\n"
-                "• /queue - View queue\n"
-                "• /history - View history"
-            )
+            await update.message.reply_text(HELP_TEXT)
     else:
         # No active session, send basic help
-        await update.message.reply_text(
-            "❓ Available commands:\n"
-            "• /search <keywords> - Find music\n"
-            "• /play <URL> - Play video/playlist\n"
-            "• /queue - View queue\n"
-            "• /history - View history"
-        )
+        await update.message.reply_text(HELP_TEXT)
+
+
+def remove_file(path: str) -> None:
+    """Delete a file, ignoring files that are already gone."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error removing file {path}: {e}")
+
+
+def scan_download_files(path: str):
+    """Yield the downloaded files under path, at any depth, skipping the thumbnail cache."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # Thumbnails are bounded by THUMBNAIL_CACHE_SIZE instead
+                if entry.path != THUMBNAIL_DIR:
+                    yield from scan_download_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
 
 
 def cleanup_old_downloads():
-    """Clean up downloads older than 1 hour."""
-    downloads_dir = "downloads"
-    if not os.path.exists(downloads_dir):
+    """Remove downloads unused for DOWNLOAD_TTL_SEC and keep the rest under DOWNLOAD_CACHE_MB."""
+    if not os.path.isdir(DOWNLOADS_DIR):
         return
     
-    current_time = datetime.now()
-    for user_dir in os.listdir(downloads_dir):
-        user_path = os.path.join(downloads_dir, user_dir)
-        if not os.path.isdir(user_path):
-            continue
-        
-        for file in os.listdir(user_path):
-            file_path = os.path.join(user_path, file)
-            if not os.path.isfile(file_path):
-                continue
-            
-            file_time = datetime.fromtimestamp(os.path.getctime(file_path))
-            if (current_time - file_time).total_seconds() > 3600:  # 1 hour
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    logger.error(f"Error removing old file {file_path}: {e}")
+    cutoff = time.time() - DOWNLOAD_TTL_SEC
+    remaining = []
+    # Covers the shared by_id/ cache and per-user directories left by older versions
+    for entry in scan_download_files(DOWNLOADS_DIR):
+        # DirEntry caches the stat result, so this is one syscall per file
+        stat = entry.stat()
+        if stat.st_mtime < cutoff:
+            remove_file(entry.path)
+        else:
+            remaining.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    # Evict least recently used files until the cache fits the size limit
+    total_size = sum(size for _, size, _ in remaining)
+    limit = DOWNLOAD_CACHE_MB * 1024 * 1024
+    for _, size, file_path in sorted(remaining):
+        if total_size <= limit:
+            break
+        remove_file(file_path)
+        total_size -= size
+
+
+def warn_if_slow_downloads_dir() -> None:
+    """Log a warning when the download cache is on a network filesystem or tmpfs (Linux only)."""
+    path = os.path.realpath(DOWNLOADS_DIR)
+    try:
+        with open("/proc/mounts") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return
+    # The longest mount point containing the directory is the one it lives on
+    fs_type = max(
+        ((mount_point, fs) for mount_point, fs in mounts
+         if path == mount_point or path.startswith(mount_point.rstrip("/") + "/")),
+        key=lambda mount: len(mount[0]), default=(None, None)
+    )[1]
+    if fs_type in SLOW_FILESYSTEMS:
+        logger.warning(f"Download cache {path} is on a {fs_type} filesystem; set MUSIC_CACHE_DIR to a local disk for faster downloads")
+    elif fs_type == "tmpfs":
+        logger.warning(f"Download cache {path} is on tmpfs; cached audio is lost on reboot and uses RAM")
+
+
+async def cleanup_loop() -> None:
+    """Evict expired and excess downloads every CLEANUP_INTERVAL_SEC."""
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL_SEC)
+        try:
+            await run_in_pool(io_executor, cleanup_old_downloads)
+        except Exception as e:
+            logger.error(f"Error cleaning up downloads: {e}")
 
 
-async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /queue command - show current queue."""
-    user_id = update.effective_user.id
-    session = get_session(user_id)
+# Tracks per queue page; keeps long playlists under Telegram's message size limit
+QUEUE_PAGE_SIZE = 20
+
+def render_queue(user_id: int, page: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Build one page of a user's queue listing, marking the current track with a "Now Playing" indicator.
     
-    if not session.queue:
-        await update.message.reply_text("📋 Queue is empty. Use /search to add tracks.")
-        return
+    Returns the message text and a keyboard to move between pages (None if everything fits on one).
+    Without a page, shows the page holding the current track.
+    """
+    session = user_sessions.get(user_id)
+    if not session or not session.queue:
+        return "📋 Queue is empty. Use /search to add tracks.", None
     
-    # Build queue message
-    message = "📋 Current Queue:\n\n"
-    for i, track in enumerate(session.queue):
-        # Format duration as MM:SS
-        duration = int(track.get('duration', 0) or 0)
-        minutes, seconds = divmod(duration, 60)
-        duration_str = f"({minutes:02d}:{seconds:02d})"
-        
-        # Add "Now Playing" indicator
-        if i == session.current_index:
-            message += f"▶️ {track['title']} {duration_str}\n"
-        else:
-            message += f"{i + 1}. {track['title']} {duration_str}\n"
+    pages = (len(session.queue) - 1) // QUEUE_PAGE_SIZE + 1
+    if page is None:
+        page = (session.current_index or 0) // QUEUE_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    start = page * QUEUE_PAGE_SIZE
+    # Only the visible window is formatted
+    message = "📋 Current Queue:\n\n" + "".join(
+        f"{'▶️' if i == session.current_index else f'{i + 1}.'} {track.title} {format_duration(track.duration)}\n"
+        for i, track in enumerate(islice(session.queue, start, start + QUEUE_PAGE_SIZE), start)
+    )
     
     # Add queue position info
     if session.current_index is not None:
         message += f"\n🎵 Now playing track {session.current_index + 1} of {len(session.queue)}"
+    if pages == 1:
+        return message, None
     
-    await update.message.reply_text(message)
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev page", callback_data=f"queue_page::{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next page ➡️", callback_data=f"queue_page::{page + 1}"))
+    return f"{message}\n📄 Page {page + 1} of {pages}", InlineKeyboardMarkup([buttons])
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /queue command - show current queue."""
+    text, reply_markup = render_queue(update.effective_user.id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
 
+async def queue_next_callback(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Play the next track in the queue."""
+    user_id = query.from_user.id
+    next_track = await run_in_pool(storage_executor, playlist_manager.dequeue, user_id)
+    if not next_track:
+        await query.answer("Queue is empty.")
+        return
+    await query.answer("Playing next track.")
+    # Play and pre-download the next song in the background
+    run_in_background(play_queued_track(context, query.message.chat_id, user_id, next_track))
+
+async def queue_view_callback(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the queue."""
+    await query.answer()
+    text, reply_markup = render_queue(query.from_user.id)
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+async def queue_page_callback(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, page: int) -> None:
+    """Show another page of the queue in place."""
+    await query.answer()
+    text, reply_markup = render_queue(query.from_user.id, page)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
+
+async def queue_play_callback(query: telegram.CallbackQuery, context: ContextTypes.DEFAULT_TYPE, idx: int) -> None:
+    """Play the queued track at the given index."""
+    user_id = query.from_user.id
+    queue = playlist_manager.list_queue(user_id)
+    if idx >= len(queue):
+        await query.answer("Invalid track.")
+        return
+    track = queue[idx]
+    await query.answer(f"Playing: {track.get('title', 'Unknown')}")
+    # Play and pre-download the next song in the background
+    run_in_background(play_queued_track(context, query.message.chat_id, user_id, track))
+
+QUEUE_ACTIONS = {
+    "queue_next": queue_next_callback,
+    "queue_view": queue_view_callback,
+}
+# Buttons carrying an index, as "<action>::<index>"
+QUEUE_INDEX_ACTIONS = {
+    "queue_play": queue_play_callback,
+    "queue_page": queue_page_callback,
+}
+
 async def queue_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Dispatch queue keyboard buttons to their handlers."""
     query = update.callback_query
-    user_id = query.from_user.id
     data = query.data
-    queue = playlist_manager.list_queue(user_id)
-    if data == "queue_next":
-        # Play next track in queue
-        if not queue:
-            await query.answer("Queue is empty.")
-            return
-        next_track = playlist_manager.dequeue(user_id)
-        if not next_track:
-            await query.answer("Queue is empty.")
-            return
-        url = next_track.get('url')
-        from utils.ytdl_wrapper import get_video_info
-        loop = asyncio.get_event_loop()
-        track_info = await loop.run_in_executor(None, get_video_info, url)
-        await context.bot.send_chat_action(chat_id=query.message.chat_id, action=ChatAction.UPLOAD_VOICE)
-        filepath = await loop.run_in_executor(None, download_audio_stream, url, user_id)
-        with open(filepath, 'rb') as audio_file:
-            await context.bot.send_audio(
-                chat_id=query.message.chat_id,
-                audio=audio_file,
-                title=track_info.get('title', 'Unknown'),
-                duration=track_info.get('duration'),
-                reply_markup=build_now_playing_keyboard(user_id)
-            )
-        storage_manager.record_play(user_id, {
-            'title': track_info.get('title', 'Unknown'),
-            'url': url,
-            'duration': track_info.get('duration', 0)
-        })
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        # Pre-download next song in queue
-        asyncio.create_task(predownload_next(user_id))
-        await query.answer("Playing next track.")
-    elif data == "queue_view":
-        # Show the queue
-        await queue_command(query, context)
-        await query.answer()
-    elif data.startswith("queue_play::"):
-        idx = int(data.split("::")[1])
-        if idx < 0 or idx >= len(queue):
-            await query.answer("Invalid track.")
-            return
-        track = queue[idx]
-        url = track.get('url')
-        from utils.ytdl_wrapper import get_video_info
-        loop = asyncio.get_event_loop()
-        track_info = await loop.run_in_executor(None, get_video_info, url)
-        await context.bot.send_chat_action(chat_id=query.message.chat_id, action=ChatAction.UPLOAD_VOICE)
-        filepath = await loop.run_in_executor(None, download_audio_stream, url, user_id)
-        with open(filepath, 'rb') as audio_file:
-            await context.bot.send_audio(
-                chat_id=query.message.chat_id,
-                audio=audio_file,
-                title=track_info.get('title', 'Unknown'),
-                duration=track_info.get('duration'),
-                reply_markup=build_now_playing_keyboard(user_id)
-            )
-        storage_manager.record_play(user_id, {
-            'title': track_info.get('title', 'Unknown'),
-            'url': url,
-            'duration': track_info.get('duration', 0)
-        })
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        # Pre-download next song in queue
-        asyncio.create_task(predownload_next(user_id))
-        await query.answer(f"Playing: {track_info.get('title', 'Unknown')}")
+    action = QUEUE_ACTIONS.get(data)
+    if action:
+        await action(query, context)
+        return
+    name, _, index = data.partition("::")
+    action = QUEUE_INDEX_ACTIONS.get(name)
+    if action and index.isdigit():
+        await action(query, context, int(index))
     else:
         await query.answer("Unknown action.")
 
@@ -913,7 +1419,7 @@ async def add_to_playlist_command(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("No recently played song to add.")
         return
     track = history[0]
-    playlist_manager.add_to_named_playlist(user_id, playlist_name, track)
+    await run_in_pool(storage_executor, playlist_manager.add_to_named_playlist, user_id, playlist_name, track)
     await update.message.reply_text(f"Added to playlist '{playlist_name}': {track['title']}")
 
 async def my_playlists_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -933,16 +1439,12 @@ async def show_playlist_callback(update: Update, context: ContextTypes.DEFAULT_T
     if not tracks:
         await query.answer("Playlist is empty.")
         return
-    lines = []
-    keyboard = []
-    for idx, track in enumerate(tracks, 1):
-        title = track.get('title', 'Unknown')
-        duration = int(track.get('duration', 0) or 0)
-        mins, secs = divmod(duration, 60)
-        button_text = f"{title[:40]} ({mins:02d}:{secs:02d})"
-        callback_data = f"playlist_play::{playlist_name}::{idx-1}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-        lines.append(f"{idx}. {title} ({mins:02d}:{secs:02d})")
+    # Build the shared callback prefix once rather than per button
+    prefix = f"playlist_play::{playlist_name}::"
+    keyboard = [
+        [InlineKeyboardButton(format_track_button(track), callback_data=f"{prefix}{idx}")]
+        for idx, track in enumerate(tracks)
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.message.reply_text(f"Playlist: {playlist_name}", reply_markup=reply_markup)
     await query.answer()
@@ -950,36 +1452,17 @@ async def show_playlist_callback(update: Update, context: ContextTypes.DEFAULT_T
 async def playlist_play_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     user_id = query.from_user.id
-    _, playlist_name, idx = query.data.split("::")
+    # Split off the index from the right, so playlist names may contain "::"
+    prefix, _, idx = query.data.rpartition("::")
+    playlist_name = prefix.partition("::")[2]
     idx = int(idx)
     tracks = playlist_manager.get_named_playlist(user_id, playlist_name)
     if idx < 0 or idx >= len(tracks):
         await query.answer("Invalid track.")
         return
     track = tracks[idx]
-    url = track.get('url')
-    from utils.ytdl_wrapper import get_video_info, download_audio_stream
-    loop = asyncio.get_event_loop()
-    track_info = await loop.run_in_executor(None, get_video_info, url)
-    await context.bot.send_chat_action(chat_id=query.message.chat_id, action=ChatAction.UPLOAD_VOICE)
-    filepath = await loop.run_in_executor(None, download_audio_stream, url, user_id)
-    with open(filepath, 'rb') as audio_file:
-        await context.bot.send_audio(
-            chat_id=query.message.chat_id,
-            audio=audio_file,
-            title=track_info.get('title', 'Unknown'),
-            duration=track_info.get('duration'),
-            reply_markup=build_now_playing_keyboard(user_id)
-        )
-    storage_manager.record_play(user_id, {
-        'title': track_info.get('title', 'Unknown'),
-        'url': url,
-        'duration': track_info.get('duration', 0)
-    })
-    if os.path.exists(filepath):
-        os.remove(filepath)
-    asyncio.create_task(predownload_next(user_id))
-    await query.answer(f"Playing: {track_info.get('title', 'Unknown')}")
+    await query.answer(f"Playing: {track.get('title', 'Unknown')}")
+    run_in_background(play_queued_track(context, query.message.chat_id, user_id, track))
 
 async def remove_from_playlist_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
@@ -992,7 +1475,9 @@ async def remove_from_playlist_command(update: Update, context: ContextTypes.DEF
     except ValueError:
         await update.message.reply_text("Index must be a number.")
         return
-    success = playlist_manager.remove_from_named_playlist(user_id, playlist_name, idx)
+    success = await run_in_pool(
+        storage_executor, playlist_manager.remove_from_named_playlist, user_id, playlist_name, idx
+    )
     if success:
         await update.message.reply_text(f"Removed track {idx+1} from playlist '{playlist_name}'.")
     else:
@@ -1012,13 +1497,64 @@ async def add_to_playlist_inline_callback(update: Update, context: ContextTypes.
     await query.message.reply_text("Reply with /addtoplaylist <playlist_name> to add this song to a playlist.")
     await query.answer("Use /addtoplaylist <playlist_name>.")
 
+async def post_init(application: Application) -> None:
+    """Load saved state and start the background workers once the application is initialized."""
+    audio_file_ids.update(await run_in_pool(storage_executor, storage_manager.load_file_ids))
+    # A damaged cache only costs re-extraction, so it never stops the bot from starting
+    try:
+        skipped = await run_in_pool(storage_executor, load_video_info_cache, VIDEO_INFO_CACHE_FILE)
+        if skipped:
+            logger.warning(f"Skipped {skipped} malformed entries in {VIDEO_INFO_CACHE_FILE}")
+    except Exception as e:
+        logger.warning(f"Starting with an empty video info cache: {e}")
+    run_in_background(history_writer())
+    run_in_background(cleanup_loop())
+    run_in_background(storage_flush_loop())
+
+async def post_shutdown(application: Application) -> None:
+    """Save plays and storage changes that are still in memory and close shared clients."""
+    plays = []
+    while not history_queue.empty():
+        plays.append(history_queue.get_nowait())
+    if plays:
+        await run_in_pool(storage_executor, storage_manager.record_plays, plays)
+    await run_in_pool(storage_executor, flush_storage)
+    await thumbnail_client.aclose()
+
 def main():
     """Start the bot."""
-    # Clean up old downloads on startup
+    # Use the libuv-based event loop when it is installed (pip install uvloop)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
+    # Clean up old downloads on startup, and create and index the thumbnail cache once
+    warn_if_slow_downloads_dir()
     cleanup_old_downloads()
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    load_thumbnail_index()
     
-    # Create the Application
-    application = ApplicationBuilder().token(os.getenv('TELEGRAM_TOKEN')).build()
+    # Create the Application with an HTTP/2 connection pool sized for concurrent uploads
+    request = HTTPXRequest(
+        connection_pool_size=int(os.getenv("TG_POOL", "32")),
+        http_version="2",
+        read_timeout=60,
+        write_timeout=120,
+        connect_timeout=10
+    )
+    application = (
+        ApplicationBuilder()
+        .token(os.getenv('TELEGRAM_TOKEN'))
+        .request(request)
+        .get_updates_request(HTTPXRequest(connection_pool_size=8, http_version="2"))
+        # Keep outgoing calls under Telegram's flood limits and retry on 429 instead of failing
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Register command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -1032,9 +1568,14 @@ def main():
     application.add_handler(CommandHandler("removefrom", remove_from_playlist_command))
     
     # Register callback handlers
+    # Playback buttons are pressed most, so their pattern is checked first
+    application.add_handler(CallbackQueryHandler(playback_callback, pattern=PLAYBACK_PATTERN))
     application.add_handler(CallbackQueryHandler(play_callback, pattern="^play::"))
-    application.add_handler(CallbackQueryHandler(playback_callback, pattern="^prev$|^pause$|^resume$|^next$|^stop$"))
-    
+    application.add_handler(CallbackQueryHandler(queue_callback, pattern="^queue_"))
+    application.add_handler(CallbackQueryHandler(show_playlist_callback, pattern="^show_playlist::"))
+    application.add_handler(CallbackQueryHandler(playlist_play_callback, pattern="^playlist_play::"))
+    application.add_handler(CallbackQueryHandler(add_to_playlist_inline_callback, pattern="^add_to_playlist$"))
+
     # Register fallback handler
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, fallback_handler))
     
@@ -0,0 +1,148 @@
+"""
+JSON file persistence shared by the storage managers.
+Uses orjson when it is installed and writes files atomically.
+"""
+
+import json
+import os
+from collections import deque
+from typing import Any, Dict, Iterable, List
+
+try:
+    # Optional: several times faster than json for the data files
+    import orjson
+except ImportError:
+    orjson = None
+
+# TODO: Add unit tests
+
+
+def _encode_default(obj: Any) -> Any:
+    """Encode types JSON has no literal for; deques are written as lists."""
+    if isinstance(obj, deque):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def load_json(path: str) -> Any:
+    """
+    Read a JSON file.
+
+    Args:
+        path: Path of the JSON file
+
+    Returns:
+        The decoded data
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        json.JSONDecodeError: If the file is not valid JSON
+    """
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def dump_json(data: Any, path: str) -> None:
+    """
+    Write data to a JSON file atomically. Deques are written as lists.
+    The data is written to a temporary file first and then renamed over the
+    target, so readers and crashes never see a half-written file.
+
+    Args:
+        data: JSON-serializable data
+        path: Path of the JSON file
+    """
+    temp_path = f"{path}.tmp"
+    if orjson is not None:
+        with open(temp_path, 'wb') as f:
+            f.write(orjson.dumps(data, default=_encode_default))
+    else:
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'), default=_encode_default)
+    os.replace(temp_path, path)
+
+
+def _dumps_line(item: Any) -> bytes:
+    """Encode one item as a JSON line."""
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(item, separators=(',', ':')) + "\n").encode()
+
+
+def load_jsonl(path: str) -> List[Any]:
+    """
+    Read a JSON Lines file, one item per line.
+    Lines that cannot be decoded (e.g. a write cut short by a crash) are skipped.
+
+    Args:
+        path: Path of the JSON Lines file
+
+    Returns:
+        The decoded items, in file order
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    items = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                items.append(loads(line))
+            except ValueError:
+                pass
+    return items
+
+
+def append_jsonl(items: Iterable[Any], path: str) -> None:
+    """
+    Append items to a JSON Lines file with a single write.
+
+    Args:
+        items: JSON-serializable items, in order
+        path: Path of the JSON Lines file
+    """
+    with open(path, 'ab') as f:
+        f.write(b"".join(_dumps_line(item) for item in items))
+
+
+def dump_jsonl(items: Iterable[Any], path: str) -> None:
+    """
+    Replace a JSON Lines file atomically.
+
+    Args:
+        items: JSON-serializable items, in order
+        path: Path of the JSON Lines file
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(b"".join(_dumps_line(item) for item in items))
+    os.replace(temp_path, path)
+
+
+def load_json_dir(directory: str) -> Dict[str, Any]:
+    """
+    Read every '<key>.json' file in a directory.
+    Files that cannot be decoded are skipped.
+
+    Args:
+        directory: Directory holding one JSON file per key
+
+    Returns:
+        Dictionary mapping each file name without '.json' to its decoded data
+    """
+    data = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    try:
+                        data[entry.name[:-5]] = load_json(entry.path)
+                    except json.JSONDecodeError:
+                        pass
+    except FileNotFoundError:
+        pass
+    return data
@@ -5,7 +5,10 @@ Handles enqueueing, dequeueing, and persistence of user queues.
 
 import json
 import os
-from typing import Dict, List, Optional
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from utils.json_store import load_json, load_json_dir, dump_json
 
 # TODO: Add unit tests
 
@@ -16,34 +19,69 @@ class PlaylistManager:
     def __init__(self):
         """Initialize playlist manager and ensure data directory exists."""
         self.data_dir = "data"
-        self.playlists_file = os.path.join(self.data_dir, "playlists.json")
+        # One file per user, so a change rewrites only that user's data
+        self.playlists_dir = os.path.join(self.data_dir, "playlists")
+        # Single file holding every user, used before per-user files
+        self.legacy_playlists_file = os.path.join(self.data_dir, "playlists.json")
+        # Users whose playlists changed since the last flush()
+        self._dirty_users: Set[str] = set()
+        self._migrating = False
         
         # Ensure data directory exists
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        # Load or create playlists file
-        if not os.path.exists(self.playlists_file):
-            with open(self.playlists_file, 'w') as f:
-                json.dump({}, f, indent=2)
+        os.makedirs(self.playlists_dir, exist_ok=True)
         
         # Load playlists into memory
         self._load_playlists()
     
     def _load_playlists(self) -> None:
-        """Load playlists from JSON file into memory."""
+        """Load playlists from the per-user JSON files into memory."""
+        self.playlists = {}
+        # Users from the old single file are rewritten to per-user files on the next flush
         try:
-            with open(self.playlists_file, 'r') as f:
-                self.playlists = json.load(f)
+            self.playlists = load_json(self.legacy_playlists_file)
+            self._dirty_users.update(self.playlists)
+            self._migrating = True
         except (json.JSONDecodeError, FileNotFoundError):
-            self.playlists = {}
+            pass
+        self.playlists.update(load_json_dir(self.playlists_dir))
+        # Normalize every user once, so the methods below never check the format:
+        # {"queue": deque of tracks, <playlist name>: list of tracks, ...}
+        for user_key, data in self.playlists.items():
+            if isinstance(data, list):
+                # Old format: the user's data was just the queue
+                data = {"queue": data}
+            # Queues are deques so dequeue pops from the front in O(1)
+            data["queue"] = deque(data.get("queue", ()))
+            self.playlists[user_key] = data
     
-    def _save_playlists(self) -> None:
-        """Save playlists from memory to JSON file."""
-        try:
-            with open(self.playlists_file, 'w') as f:
-                json.dump(self.playlists, f, indent=2)
-        except Exception as e:
-            raise Exception(f"Failed to save playlists: {str(e)}")
+    def _user_playlists(self, user_id: int) -> Dict:
+        """Get the user's queue and named playlists, creating them on first use."""
+        user_key = str(user_id)
+        data = self.playlists.get(user_key)
+        if data is None:
+            data = self.playlists[user_key] = {"queue": deque()}
+        return data
+    
+    def _save_playlists(self, user_key: str) -> None:
+        """Mark a user's playlists as changed; flush() writes them to disk."""
+        self._dirty_users.add(user_key)
+    
+    def flush(self) -> None:
+        """Write the playlists of every user changed since the last flush to their JSON files."""
+        while self._dirty_users:
+            user_key = self._dirty_users.pop()
+            try:
+                dump_json(self.playlists.get(user_key, {}), os.path.join(self.playlists_dir, f"{user_key}.json"))
+            except Exception as e:
+                self._dirty_users.add(user_key)
+                raise Exception(f"Failed to save playlists: {str(e)}")
+        if self._migrating:
+            # Every user now has a file of their own
+            try:
+                os.remove(self.legacy_playlists_file)
+            except FileNotFoundError:
+                pass
+            self._migrating = False
     
     def enqueue(self, user_id: int, track_info: Dict) -> None:
         """
@@ -53,41 +91,17 @@ class PlaylistManager:
             user_id: User ID
             track_info: Dictionary with track information (id, title, url, duration)
         """
-        user_key = str(user_id)
-        if user_key not in self.playlists:
-            self.playlists[user_key] = []
-        # If using new dict format, append to 'queue'
-        if isinstance(self.playlists[user_key], dict):
-            if "queue" not in self.playlists[user_key]:
-                self.playlists[user_key]["queue"] = []
-            self.playlists[user_key]["queue"].append(track_info)
-        # If using old list format, append directly
-        elif isinstance(self.playlists[user_key], list):
-            self.playlists[user_key].append(track_info)
-        self._save_playlists()
+        self._user_playlists(user_id)["queue"].append(track_info)
+        self._save_playlists(str(user_id))
     
     def dequeue(self, user_id: int) -> Optional[Dict]:
         """Remove and return the first track from the user's queue."""
-        user_key = str(user_id)
-        if user_key not in self.playlists:
+        queue = self.list_queue(user_id)
+        if not queue:
             return None
-            
-        # Handle both old list format and new dictionary format
-        if isinstance(self.playlists[user_key], list):
-            if not self.playlists[user_key]:
-                return None
-            track = self.playlists[user_key].pop(0)
-            self._save_playlists()
-            return track
-        elif isinstance(self.playlists[user_key], dict):
-            queue = self.playlists[user_key].get('queue', [])
-            if not queue:
-                return None
-            track = queue.pop(0)
-            self.playlists[user_key]['queue'] = queue
-            self._save_playlists()
-            return track
-        return None
+        track = queue.popleft()
+        self._save_playlists(str(user_id))
+        return track
     
     def peek(self, user_id: int) -> Optional[Dict]:
         """
@@ -99,12 +113,8 @@ class PlaylistManager:
         Returns:
             Track dictionary or None if queue is empty
         """
-        user_key = str(user_id)
-        
-        if user_key not in self.playlists or not self.playlists[user_key]:
-            return None
-        
-        return self.playlists[user_key][0]
+        queue = self.list_queue(user_id)
+        return queue[0] if queue else None
     
     def clear(self, user_id: int) -> None:
         """
@@ -113,61 +123,39 @@ class PlaylistManager:
         Args:
             user_id: User ID
         """
-        user_key = str(user_id)
-        
-        if user_key in self.playlists:
-            self.playlists[user_key] = []
-            self._save_playlists()
+        queue = self.list_queue(user_id)
+        if queue:
+            queue.clear()
+            self._save_playlists(str(user_id))
     
-    def list_queue(self, user_id: int) -> List[Dict]:
+    def list_queue(self, user_id: int) -> Deque[Dict]:
         """Get the user's current queue."""
-        user_key = str(user_id)
-        if user_key not in self.playlists:
-            return []
-            
-        # Handle both old list format and new dictionary format
-        if isinstance(self.playlists[user_key], list):
-            return self.playlists[user_key]
-        elif isinstance(self.playlists[user_key], dict):
-            return self.playlists[user_key].get('queue', [])
-        return []
+        data = self.playlists.get(str(user_id))
+        return data["queue"] if data else deque()
+
+    def queue_len(self, user_id: int) -> int:
+        """Get the number of tracks in the user's queue."""
+        return len(self.list_queue(user_id))
 
     def add_to_named_playlist(self, user_id: int, playlist_name: str, track_info: Dict) -> None:
         """Add a track to a named playlist for the user."""
-        user_key = str(user_id)
-        if user_key not in self.playlists:
-            self.playlists[user_key] = {}
-        if not isinstance(self.playlists[user_key], dict):
-            # Migrate old queue format to playlists dict
-            self.playlists[user_key] = {"queue": self.playlists[user_key]}
-        if playlist_name not in self.playlists[user_key]:
-            self.playlists[user_key][playlist_name] = []
-        self.playlists[user_key][playlist_name].append(track_info)
-        self._save_playlists()
+        self._user_playlists(user_id).setdefault(playlist_name, []).append(track_info)
+        self._save_playlists(str(user_id))
 
     def list_named_playlists(self, user_id: int) -> List[str]:
         """List all playlist names for the user."""
-        user_key = str(user_id)
-        if user_key not in self.playlists or not isinstance(self.playlists[user_key], dict):
-            return []
-        return list(self.playlists[user_key].keys())
+        data = self.playlists.get(str(user_id), {})
+        return [name for name in data if name != "queue"]
 
     def get_named_playlist(self, user_id: int, playlist_name: str) -> List[Dict]:
         """Get all tracks in a named playlist for the user."""
-        user_key = str(user_id)
-        if user_key not in self.playlists or not isinstance(self.playlists[user_key], dict):
-            return []
-        return self.playlists[user_key].get(playlist_name, [])
+        return self.playlists.get(str(user_id), {}).get(playlist_name, [])
 
     def remove_from_named_playlist(self, user_id: int, playlist_name: str, index: int) -> bool:
         """Remove a track by index from a named playlist. Returns True if removed."""
-        user_key = str(user_id)
-        if user_key not in self.playlists or not isinstance(self.playlists[user_key], dict):
-            return False
-        playlist = self.playlists[user_key].get(playlist_name, [])
+        playlist = self.get_named_playlist(user_id, playlist_name)
         if 0 <= index < len(playlist):
             del playlist[index]
-            self.playlists[user_key][playlist_name] = playlist
-            self._save_playlists()
+            self._save_playlists(str(user_id))
             return True
         return False
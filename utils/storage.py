@@ -5,11 +5,19 @@ Handles recording and retrieving user play history with JSON persistence.
 
 import json
 import os
-from datetime import datetime
-from typing import Dict, List
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Set, Tuple
+
+from utils.json_store import load_json, dump_json, load_jsonl, append_jsonl, dump_jsonl
 
 # TODO: Add unit tests
 
+# Plays kept per user, most recent first
+HISTORY_LIMIT = 100
+# A user's log is compacted back to HISTORY_LIMIT lines once it grows past this
+HISTORY_LOG_MAX_LINES = 5 * HISTORY_LIMIT
 
 class StorageManager:
     """Manages user listening history with JSON persistence."""
@@ -17,34 +25,92 @@ class StorageManager:
     def __init__(self):
         """Initialize storage manager and ensure data directory exists."""
         self.data_dir = "data"
-        self.history_file = os.path.join(self.data_dir, "history.json")
+        # One append-only JSON Lines log per user, oldest play first, so a play
+        # costs one small append instead of rewriting the user's history
+        self.history_dir = os.path.join(self.data_dir, "history")
+        # Single file holding every user, used before per-user logs
+        self.legacy_history_file = os.path.join(self.data_dir, "history.json")
+        self.file_ids_file = os.path.join(self.data_dir, "file_ids.json")
+        # Plays recorded since the last flush(), per user, oldest first
+        self._pending: Dict[str, List[Dict]] = {}
+        # Lines in each user's log, so flush() knows when to compact it
+        self._log_lines: Dict[str, int] = {}
+        # Users whose log must be rewritten from memory (migration or compaction)
+        self._rewrite_users: Set[str] = set()
+        # Old-format files to remove once their users have logs
+        self._legacy_files: List[str] = []
         
         # Ensure data directory exists
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        # Load or create history file
-        if not os.path.exists(self.history_file):
-            with open(self.history_file, 'w') as f:
-                json.dump({}, f, indent=2)
+        os.makedirs(self.history_dir, exist_ok=True)
         
         # Load history into memory
         self._load_history()
     
+    def _log_path(self, user_key: str) -> str:
+        """Get the path of a user's history log."""
+        return os.path.join(self.history_dir, f"{user_key}.jsonl")
+    
     def _load_history(self) -> None:
-        """Load history from JSON file into memory."""
+        """Load history from the per-user logs into memory."""
+        self.history = {}
+        with os.scandir(self.history_dir) as files:
+            for entry in files:
+                if not entry.name.endswith('.jsonl') or not entry.is_file():
+                    continue
+                user_key = entry.name[:-6]
+                entries = load_jsonl(entry.path)
+                # Logs are oldest first, the in-memory history most recent first;
+                # bounded deques drop the oldest play by themselves
+                self.history[user_key] = deque(maxlen=HISTORY_LIMIT)
+                self.history[user_key].extendleft(entries[-HISTORY_LIMIT:])
+                self._log_lines[user_key] = len(entries)
+        
+        # The old single file stores lists newest first; its users are rewritten as logs on the next flush
+        legacy = {}
         try:
-            with open(self.history_file, 'r') as f:
-                self.history = json.load(f)
+            legacy = load_json(self.legacy_history_file)
+            self._legacy_files.append(self.legacy_history_file)
         except (json.JSONDecodeError, FileNotFoundError):
-            self.history = {}
+            pass
+        for user_key, entries in legacy.items():
+            # A log already written for the user is newer than the old file
+            if user_key not in self.history:
+                self.history[user_key] = deque(entries, maxlen=HISTORY_LIMIT)
+                self._rewrite_users.add(user_key)
     
-    def _save_history(self) -> None:
-        """Save history from memory to JSON file."""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
-        except Exception as e:
-            raise Exception(f"Failed to save history: {str(e)}")
+    def flush(self) -> None:
+        """Append plays recorded since the last flush to the users' logs, compacting logs that grew too long."""
+        while self._rewrite_users:
+            user_key = self._rewrite_users.pop()
+            try:
+                dump_jsonl(reversed(self.history[user_key]), self._log_path(user_key))
+            except Exception as e:
+                self._rewrite_users.add(user_key)
+                raise Exception(f"Failed to save history: {str(e)}")
+            # The rewrite already holds the pending plays
+            self._pending.pop(user_key, None)
+            self._log_lines[user_key] = len(self.history[user_key])
+        
+        while self._pending:
+            user_key, entries = self._pending.popitem()
+            try:
+                append_jsonl(entries, self._log_path(user_key))
+            except Exception as e:
+                self._pending[user_key] = entries
+                raise Exception(f"Failed to save history: {str(e)}")
+            self._log_lines[user_key] = self._log_lines.get(user_key, 0) + len(entries)
+            if self._log_lines[user_key] > HISTORY_LOG_MAX_LINES:
+                self._rewrite_users.add(user_key)
+        
+        # Compact the logs that outgrew HISTORY_LOG_MAX_LINES and drop old-format files
+        if self._rewrite_users:
+            self.flush()
+        while self._legacy_files:
+            remove_path = self._legacy_files.pop()
+            try:
+                os.remove(remove_path)
+            except FileNotFoundError:
+                pass
     
     def record_play(self, user_id: int, track_info: Dict) -> None:
         """
@@ -54,11 +120,25 @@ class StorageManager:
             user_id: User ID
             track_info: Dictionary with track information (title, url, duration)
         """
+        self._add_entry(user_id, track_info)
+    
+    def record_plays(self, plays: List[Tuple[int, Dict]]) -> None:
+        """
+        Record several track plays; each user's log gets one append on the next flush.
+        
+        Args:
+            plays: List of (user_id, track_info) tuples, oldest first
+        """
+        for user_id, track_info in plays:
+            self._add_entry(user_id, track_info)
+    
+    def _add_entry(self, user_id: int, track_info: Dict) -> None:
+        """Add a play to the in-memory history and queue it for the next flush."""
         user_key = str(user_id)
         
         # Create history entry
         history_entry = {
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': int(time.time()),
             'title': track_info.get('title', 'Unknown'),
             'url': track_info.get('url', ''),
             'duration': track_info.get('duration', 0)
@@ -66,16 +146,11 @@ class StorageManager:
         
         # Initialize user history if it doesn't exist
         if user_key not in self.history:
-            self.history[user_key] = []
-        
-        # Add new entry to the beginning of the list (most recent first)
-        self.history[user_key].insert(0, history_entry)
+            self.history[user_key] = deque(maxlen=HISTORY_LIMIT)
         
-        # Keep only the last 100 entries
-        if len(self.history[user_key]) > 100:
-            self.history[user_key] = self.history[user_key][:100]
-        
-        self._save_history()
+        # Add new entry to the beginning (most recent first); the deque drops the oldest past HISTORY_LIMIT
+        self.history[user_key].appendleft(history_entry)
+        self._pending.setdefault(user_key, []).append(history_entry)
     
     def get_history(self, user_id: int, limit: int = 10) -> List[Dict]:
         """
@@ -89,7 +164,31 @@ class StorageManager:
             List of history entries (most recent first)
         """
         user_key = str(user_id)
-        user_history = self.history.get(user_key, [])
+        user_history = self.history.get(user_key, ())
         
         # Return the most recent entries up to the limit
-        return user_history[:limit]
+        return list(islice(user_history, limit))
+    
+    def load_file_ids(self) -> Dict[str, str]:
+        """
+        Load the saved Telegram file_id of every uploaded track.
+        
+        Returns:
+            Dictionary mapping YouTube video ID to Telegram file_id
+        """
+        try:
+            return load_json(self.file_ids_file)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {}
+    
+    def save_file_ids(self, file_ids: Dict[str, str]) -> None:
+        """
+        Save the Telegram file_id of every uploaded track.
+        
+        Args:
+            file_ids: Dictionary mapping YouTube video ID to Telegram file_id
+        """
+        try:
+            dump_json(file_ids, self.file_ids_file)
+        except Exception as e:
+            raise Exception(f"Failed to save file IDs: {str(e)}")
@@ -3,20 +3,122 @@ YouTube interactions using yt-dlp.
 Handles searching, playlist extraction, and audio downloading.
 """
 
+import atexit
+import json
 import os
+import threading
+import time
 import yt_dlp
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
 import re
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+import shutil
 import asyncio
 
+from utils.json_store import load_json, dump_json
+
 # TODO: Add unit tests
 
+__all__ = [
+    'search_youtube', 'iter_playlist_videos', 'extract_playlist_videos',
+    'extract_video_id', 'canonical_url', 'is_playlist_url', 'sanitize_filename',
+    'download_audio_stream', 'get_cached_video_info', 'get_video_info', 'aget_video_info',
+    'hydrate_playlist', 'load_video_info_cache', 'save_video_info_cache',
+]
+
+_VIDEO_ID_RE = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})')
+_BARE_VIDEO_ID_RE = re.compile(r'[A-Za-z0-9_-]{11}')
+_PLAYLIST_RE = re.compile(r'[?&]list=')
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\-_\. ]')
+
+# Video metadata cache, keyed by canonical URL: {url: (stored_at, info)}, stored_at in epoch seconds
+VIDEO_INFO_TTL = 3600  # seconds; titles and durations rarely change, so replays within an hour skip extraction
+VIDEO_INFO_CACHE_SIZE = 1024
+_video_info_cache: Dict[str, Tuple[float, Dict]] = {}
+# Whether the cache changed since it was last saved
+_video_info_dirty = False
+
+# Search results cache, keyed by (normalized query, max_results): {key: (stored_at, results)}
+SEARCH_CACHE_TTL = 120  # seconds
+SEARCH_CACHE_SIZE = 256
+_search_cache: Dict[Tuple[str, int], Tuple[float, List[Dict]]] = {}
+
+# Serializes cache writes: lookups run on several pool threads, and two threads
+# evicting at once could pick the same oldest key
+_cache_lock = threading.Lock()
+
+# Download transfer tuning: fragments fetched in parallel for DASH/HLS formats, and
+# chunked range requests for single-file formats, which YouTube throttles less
+CONCURRENT_FRAGMENTS = 8
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+# aria2c, when installed, splits every download over several connections
+ARIA2C_ARGS = ['-x16', '-s16', '-k1M']
+_ARIA2C = shutil.which('aria2c')
+
+# yt-dlp caches the YouTube player's signature functions here. Its default is under the
+# home directory, which hosted deployments often wipe; next to the data files it persists.
+YTDLP_CACHE_DIR = os.path.join("data", "yt-dlp-cache")
+
+# Options for metadata-only extraction: flat listings (search, playlists) and single videos
+_FLAT_OPTS = {
+    'cachedir': YTDLP_CACHE_DIR,
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'skip_download': True,
+}
+_INFO_OPTS = {
+    'cachedir': YTDLP_CACHE_DIR,
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    # Only title, duration, uploader and thumbnail are used: skip probing formats and
+    # fetching the DASH/HLS manifests and translated subtitle lists
+    'check_formats': False,
+    'extractor_args': {'youtube': {'skip': ['dash', 'hls', 'translated_subs']}},
+}
+
+# Used when callers pass no executor, instead of the loop's default pool (up to 32
+# threads), so yt-dlp calls stay few enough not to trip YouTube's per-IP throttling
+DEFAULT_POOL_SIZE = 4
+_default_executor = ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE, thread_name_prefix="ytdl-default")
+atexit.register(_default_executor.shutdown, wait=False, cancel_futures=True)
+
+# Long-lived YoutubeDL instances, one per thread and options, so metadata lookups reuse
+# open HTTP connections instead of paying a TLS handshake each time
+_ydl_local = threading.local()
+
+
+def _get_ydl(opts: Dict) -> yt_dlp.YoutubeDL:
+    """Get this thread's YoutubeDL for the given module-level options, creating it on first use."""
+    instances = _ydl_local.__dict__.setdefault('instances', {})
+    ydl = instances.get(id(opts))
+    if ydl is None:
+        # YoutubeDL is not thread-safe, hence one instance per worker thread
+        ydl = instances[id(opts)] = yt_dlp.YoutubeDL(opts)
+        atexit.register(ydl.close)
+    return ydl
+
+
+def _search_result(entry: Dict) -> Dict:
+    """Build a search result from a flat yt-dlp search entry."""
+    video_id = entry.get('id', '')
+    return {
+        'id': video_id,
+        'title': entry.get('title', 'Unknown'),
+        'duration': entry.get('duration', 0),
+        # Built only when missing; a get() default would format the URL for every entry
+        'webpage_url': entry.get('webpage_url') or f"https://youtube.com/watch?v={video_id}",
+        # Flat search entries usually carry no thumbnail; YouTube serves one per ID
+        'thumbnail': entry.get('thumbnail') or (f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg" if video_id else ''),
+        'uploader': entry.get('uploader') or entry.get('channel') or 'Unknown Artist'
+    }
+
 
 def search_youtube(query: str, max_results: int = 5) -> List[Dict]:
     """
     Search YouTube for videos matching the query.
+    Results are cached for SEARCH_CACHE_TTL seconds and also stored in the video info cache.
     
     Args:
         query: Search keywords
@@ -25,35 +127,76 @@ def search_youtube(query: str, max_results: int = 5) -> List[Dict]:
     Returns:
         List of dictionaries with video information
     """
+    key = (" ".join(query.lower().split()), max_results)
+    entry = _search_cache.get(key)
+    if entry is not None and time.monotonic() - entry[0] <= SEARCH_CACHE_TTL:
+        return entry[1]
+    
     search_query = f"ytsearch{max_results}:{query}"
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'skip_download': True,
-    }
+    try:
+        search_results = _get_ydl(_FLAT_OPTS).extract_info(search_query, download=False)
+        
+        results = [_search_result(entry) for entry in search_results.get('entries') or () if entry]
+        # Seed the info cache so picking a result needs no second extraction
+        for result in results:
+            if result['id']:
+                _cache_video_info(result['webpage_url'], result)
+        
+        # Evict the oldest search when full
+        with _cache_lock:
+            _search_cache.pop(key, None)
+            if len(_search_cache) >= SEARCH_CACHE_SIZE:
+                _search_cache.pop(next(iter(_search_cache)))
+            _search_cache[key] = (time.monotonic(), results)
+        return results
+        
+    except Exception as e:
+        raise Exception(f"YouTube search failed: {str(e)}")
+
+
+# Redirects (e.g. a watch URL with a list= parameter pointing at its playlist) followed at most
+_MAX_PLAYLIST_REDIRECTS = 3
+
+
+def iter_playlist_videos(playlist_url: str) -> Iterator[Dict]:
+    """
+    Yield the videos of a YouTube playlist as yt-dlp fetches its pages.
+    The playlist is not processed by yt-dlp, so entries stream one page at a time
+    instead of being collected and post-processed as a whole first.
+    The generator has its own YoutubeDL, so it may be advanced from any thread,
+    one call at a time, e.g. a page per run_in_executor call.
     
+    Args:
+        playlist_url: YouTube playlist URL
+        
+    Yields:
+        Dictionaries with video information, in playlist order
+    """
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(search_query, download=False)
+        # Closed when the generator is exhausted or closed
+        with yt_dlp.YoutubeDL(_FLAT_OPTS) as ydl:
+            playlist_info = ydl.extract_info(playlist_url, download=False, process=False)
+            for _ in range(_MAX_PLAYLIST_REDIRECTS):
+                if playlist_info.get('_type') not in ('url', 'url_transparent'):
+                    break
+                playlist_info = ydl.extract_info(playlist_info['url'], download=False, process=False)
             
-            results = []
-            for entry in search_results.get('entries', []):
+            for entry in playlist_info.get('entries') or ():
                 if entry:
-                    results.append({
-                        'id': entry.get('id', ''),
+                    video_id = entry.get('id', '')
+                    yield {
+                        'id': video_id,
                         'title': entry.get('title', 'Unknown'),
+                        'url': entry.get('url') or f"https://youtube.com/watch?v={video_id}",
                         'duration': entry.get('duration', 0),
-                        'webpage_url': entry.get('webpage_url', f"https://youtube.com/watch?v={entry.get('id', '')}"),
-                        'thumbnail': entry.get('thumbnail', ''),
-                        'uploader': entry.get('uploader', 'Unknown Artist')
-                    })
-            
-            return results
-            
+                        # Flat playlist entries usually carry no thumbnail; YouTube serves one per ID
+                        'thumbnail': entry.get('thumbnail') or (f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg" if video_id else ''),
+                        'uploader': entry.get('uploader') or entry.get('channel') or 'Unknown Artist'
+                    }
+        
     except Exception as e:
-        raise Exception(f"YouTube search failed: {str(e)}")
+        raise Exception(f"Playlist extraction failed: {str(e)}")
 
 
 def extract_playlist_videos(playlist_url: str) -> List[Dict]:
@@ -66,79 +209,83 @@ def extract_playlist_videos(playlist_url: str) -> List[Dict]:
     Returns:
         List of dictionaries with video information
     """
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'skip_download': True,
-    }
+    return list(iter_playlist_videos(playlist_url))
+
+
+def extract_video_id(url: str) -> str:
+    """
+    Extract the YouTube video ID from a URL or bare ID.
     
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            playlist_info = ydl.extract_info(playlist_url, download=False)
-            
-            videos = []
-            for entry in playlist_info.get('entries', []):
-                if entry:
-                    videos.append({
-                        'id': entry.get('id', ''),
-                        'title': entry.get('title', 'Unknown'),
-                        'url': entry.get('webpage_url', f"https://youtube.com/watch?v={entry.get('id', '')}"),
-                        'duration': entry.get('duration', 0),
-                        'thumbnail': entry.get('thumbnail', ''),
-                        'uploader': entry.get('uploader', 'Unknown Artist')
-                    })
-            
-            return videos
-            
-    except Exception as e:
-        raise Exception(f"Playlist extraction failed: {str(e)}")
+    Args:
+        url: YouTube video URL or ID
+        
+    Returns:
+        The 11-character video ID, or an empty string if none is found
+    """
+    match = _VIDEO_ID_RE.search(url)
+    if match:
+        return match.group(1)
+    if _BARE_VIDEO_ID_RE.fullmatch(url):
+        return url
+    return ''
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalize a YouTube video URL or ID so different URL shapes share cache entries.
+    
+    Args:
+        url: YouTube video URL (watch, youtu.be, shorts, embed) or bare ID
+        
+    Returns:
+        'https://youtube.com/watch?v=<id>', or the input unchanged if no ID is found
+    """
+    video_id = extract_video_id(url)
+    return f"https://youtube.com/watch?v={video_id}" if video_id else url
+
+
+def is_playlist_url(url: str) -> bool:
+    """Check whether a URL points to a YouTube playlist."""
+    return _PLAYLIST_RE.search(url) is not None
 
 
 def sanitize_filename(name: str) -> str:
     """Sanitize string for safe filenames."""
-    return re.sub(r'[^\w\-_\. ]', '_', name)
+    return _UNSAFE_FILENAME_RE.sub('_', name)
 
 
-async def download_audio_stream(url: str, user_id: int) -> Dict:
+async def download_audio_stream(url: str, executor: Optional[Executor] = None,
+                                downloads_root: str = "downloads") -> Dict:
     """
-    Download audio from YouTube video and convert to MP3.
-    If already downloaded, reuse the file.
+    Download audio from YouTube video as M4A.
+    AAC sources are remuxed without re-encoding; other codecs are converted.
+    Files are shared by all users at <downloads_root>/by_id/<first 2 chars of ID>/<ID>.m4a;
+    if already downloaded, reuse the file.
     Args:
         url: YouTube video URL or ID
-        user_id: User ID for organizing downloads
+        executor: Thread pool for the blocking yt-dlp calls (a small shared pool if None)
+        downloads_root: Directory holding the download cache
     Returns:
         Dictionary containing:
         - filepath: Absolute path to the downloaded audio file
+        - id: YouTube video ID
+        - title: Video title
+        - duration: Duration in seconds
         - uploader: Name of the uploader/artist
         - thumbnail: URL of the video thumbnail
     """
-    # Get video info for title
-    info = await asyncio.get_event_loop().run_in_executor(None, get_video_info, url)
-    title = info.get('title', 'Unknown')
-    video_id = info.get('id', '')
-    uploader = info.get('uploader', 'Unknown Artist')
-    thumbnail = info.get('thumbnail', '')
-    
-    # Sanitize title for filename
-    safe_title = sanitize_filename(title)
-    download_dir = f"downloads/{user_id}"
-    os.makedirs(download_dir, exist_ok=True)
-    audio_path = os.path.join(download_dir, f"{safe_title}_{video_id}.m4a")
-    
-    # If file exists, return it with metadata
-    if os.path.exists(audio_path):
-        return {
-            'filepath': os.path.abspath(audio_path),
-            'uploader': uploader,
-            'thumbnail': thumbnail
-        }
-    
-    # Download to temp file first
-    temp_audio_path = os.path.join(download_dir, f"{video_id}.m4a")
+    loop = asyncio.get_running_loop()
+    # Video info for the title is usually already cached by the caller
+    cached_info = get_cached_video_info(url)
+    cache_dir = os.path.join(downloads_root, 'by_id')
     ydl_opts = {
-        'format': 'bestaudio/best',  # More flexible format selection
-        'outtmpl': os.path.join(download_dir, '%(id)s.%(ext)s'),
+        # A single audio-only stream, AAC first so no video is fetched and muxed
+        'format': 'bestaudio[ext=m4a]/bestaudio/best',
+        # Downloaded under a temporary name; yt-dlp creates the directory
+        'outtmpl': os.path.join(cache_dir, '%(id).2s', '%(id)s.dl.%(ext)s'),
+        'cachedir': YTDLP_CACHE_DIR,
+        # Audio formats come from the player response; the DASH manifest and subtitles are unused
+        'extractor_args': {'youtube': {'skip': ['dash', 'translated_subs']}},
         'quiet': True,
         'no_warnings': True,
         'nocheckcertificate': True,
@@ -150,35 +297,173 @@ async def download_audio_stream(url: str, user_id: int) -> Dict:
         'writethumbnail': False,
         'noplaylist': True,
         'extract_flat': False,
-        'concurrent_fragments': 4,  # Parallel fragment downloads
+        'concurrent_fragments': CONCURRENT_FRAGMENTS,  # Parallel fragment downloads
+        'http_chunk_size': HTTP_CHUNK_SIZE,
+        # Stream-copies AAC into the m4a container, and only re-encodes other codecs (e.g. Opus)
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'm4a',
             'preferredquality': '192',
         }],
     }
+    if _ARIA2C:
+        ydl_opts['external_downloader'] = 'aria2c'
+        ydl_opts['external_downloader_args'] = {'aria2c': ARIA2C_ARGS}
     try:
+        # All filesystem calls happen here, off the event loop
         def _download():
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            # Rename to include title
-            if os.path.exists(temp_audio_path):
-                os.rename(temp_audio_path, audio_path)
-            return os.path.abspath(audio_path)
+                info = cached_info
+                extracted = None
+                if info is None:
+                    # One extraction serves both the metadata and the download below
+                    extracted = ydl.extract_info(url, download=False)
+                    info = _video_info_from(extracted, url)
+                    _cache_video_info(url, info)
+                
+                video_id = info.get('id', '')
+                download_dir = os.path.join(cache_dir, video_id[:2])
+                audio_path = os.path.join(download_dir, f"{video_id}.m4a")
+                
+                # If a non-empty file exists, reuse it (touch it so cache eviction sees it as recent)
+                try:
+                    if os.stat(audio_path).st_size > 0:
+                        os.utime(audio_path)
+                        return os.path.abspath(audio_path), info
+                except FileNotFoundError:
+                    pass
+                if extracted is not None:
+                    # Download from the info already extracted instead of extracting again
+                    result = ydl.process_ie_result(extracted, download=True)
+                else:
+                    result = ydl.extract_info(url, download=True)
+            # yt-dlp reports where the postprocessed file ended up, so no name is guessed
+            downloads = result.get('requested_downloads') or [{}]
+            downloaded_path = downloads[0].get('filepath') or os.path.join(download_dir, f"{video_id}.dl.m4a")
+            # Renamed only once complete, so a crash never leaves a partial file at the cached path
+            try:
+                os.replace(downloaded_path, audio_path)
+            except FileNotFoundError:
+                raise Exception(f"Download produced no file for {video_id}")
+            return os.path.abspath(audio_path), info
             
-        filepath = await asyncio.get_event_loop().run_in_executor(None, _download)
+        filepath, info = await loop.run_in_executor(executor or _default_executor, _download)
         return {
             'filepath': filepath,
-            'uploader': uploader,
-            'thumbnail': thumbnail
+            'id': info.get('id', ''),
+            'title': info.get('title', 'Unknown'),
+            'duration': info.get('duration', 0),
+            'uploader': info.get('uploader', 'Unknown Artist'),
+            'thumbnail': info.get('thumbnail', '')
         }
     except Exception as e:
         raise Exception(f"Audio download failed: {str(e)}")
 
 
+def get_cached_video_info(url: str) -> Optional[Dict]:
+    """
+    Get video information from the in-memory cache without touching YouTube.
+    
+    Args:
+        url: YouTube video URL or ID
+        
+    Returns:
+        Dictionary with video information, or None if not cached or expired
+    """
+    key = canonical_url(url)
+    entry = _video_info_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, info = entry
+    if time.time() - stored_at > VIDEO_INFO_TTL:
+        _video_info_cache.pop(key, None)
+        return None
+    return info
+
+
+def _cache_video_info(url: str, info: Dict) -> None:
+    """Store video information in the cache, evicting the oldest entry when full."""
+    global _video_info_dirty
+    key = canonical_url(url)
+    with _cache_lock:
+        _video_info_cache.pop(key, None)
+        if len(_video_info_cache) >= VIDEO_INFO_CACHE_SIZE:
+            _video_info_cache.pop(next(iter(_video_info_cache)))
+        _video_info_cache[key] = (time.time(), info)
+        _video_info_dirty = True
+
+
+def load_video_info_cache(path: str) -> int:
+    """
+    Load video information saved by save_video_info_cache, skipping expired and malformed entries.
+    
+    Args:
+        path: Path of the JSON cache file
+        
+    Returns:
+        Number of malformed entries that were skipped
+    """
+    try:
+        saved = load_json(path)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return 0
+    if not isinstance(saved, dict):
+        raise Exception(f"Failed to load video info cache: {path} does not hold a JSON object")
+    now = time.time()
+    skipped = 0
+    with _cache_lock:
+        for key, entry in saved.items():
+            # Each entry is a [stored_at, info] pair; anything else is left out rather than served later
+            try:
+                stored_at, info = entry
+                expired = now - stored_at > VIDEO_INFO_TTL
+            except (ValueError, TypeError):
+                skipped += 1
+                continue
+            if not isinstance(info, dict):
+                skipped += 1
+            elif not expired:
+                _video_info_cache[key] = (stored_at, info)
+    return skipped
+
+
+def save_video_info_cache(path: str) -> None:
+    """
+    Save the video information cache, if it changed, so restarts skip extraction for recent tracks.
+    
+    Args:
+        path: Path of the JSON cache file
+    """
+    global _video_info_dirty
+    with _cache_lock:
+        if not _video_info_dirty:
+            return
+        _video_info_dirty = False
+        # Copy first: lookups on other threads may add entries meanwhile
+        snapshot = dict(_video_info_cache)
+    try:
+        dump_json(snapshot, path)
+    except Exception as e:
+        _video_info_dirty = True
+        raise Exception(f"Failed to save video info cache: {str(e)}")
+
+
+def _video_info_from(info: Dict, url: str) -> Dict:
+    """Pick the fields the bot uses out of a yt-dlp info dict."""
+    return {
+        'id': info.get('id', ''),
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'webpage_url': info.get('webpage_url', url),
+        'thumbnail': info.get('thumbnail', ''),
+        'uploader': info.get('uploader', 'Unknown Artist')
+    }
+
+
 def get_video_info(url: str) -> Dict:
     """
     Get video information without downloading.
+    Results are cached for VIDEO_INFO_TTL seconds.
     
     Args:
         url: YouTube video URL or ID
@@ -186,23 +471,62 @@ def get_video_info(url: str) -> Dict:
     Returns:
         Dictionary with video information
     """
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-    }
+    cached = get_cached_video_info(url)
+    if cached is not None:
+        return cached
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return {
-                'id': info.get('id', ''),
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration', 0),
-                'webpage_url': info.get('webpage_url', url),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown Artist')
-            }
-            
+        info = _get_ydl(_INFO_OPTS).extract_info(url, download=False)
+        video_info = _video_info_from(info, url)
+        _cache_video_info(url, video_info)
+        return video_info
+        
     except Exception as e:
         raise Exception(f"Failed to get video info: {str(e)}")
+
+
+async def aget_video_info(url: str, executor: Optional[Executor] = None) -> Dict:
+    """
+    Get video information without blocking the event loop.
+    Cache hits return directly; misses run get_video_info on the executor.
+    
+    Args:
+        url: YouTube video URL or ID
+        executor: Thread pool for the blocking yt-dlp call (a small shared pool if None)
+        
+    Returns:
+        Dictionary with video information
+    """
+    info = get_cached_video_info(url)
+    if info is None:
+        info = await asyncio.get_running_loop().run_in_executor(executor or _default_executor, get_video_info, url)
+    return info
+
+
+# Metadata lookups hydrate_playlist runs at once
+HYDRATE_CONCURRENCY = 8
+
+
+async def hydrate_playlist(videos: List[Dict], executor: Optional[Executor] = None,
+                           concurrency: int = HYDRATE_CONCURRENCY) -> List[Optional[Dict]]:
+    """
+    Get full video information for playlist entries concurrently, filling the info cache.
+    
+    Args:
+        videos: Entries from iter_playlist_videos or extract_playlist_videos
+        executor: Thread pool for the blocking yt-dlp calls (a small shared pool if None)
+        concurrency: Maximum lookups in flight at once
+        
+    Returns:
+        Video information for each entry, in order, or None where the lookup failed
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def fetch(video: Dict) -> Optional[Dict]:
+        async with semaphore:
+            try:
+                return await aget_video_info(video['url'], executor)
+            except Exception:
+                return None
+    
+    return await asyncio.gather(*(fetch(video) for video in videos))